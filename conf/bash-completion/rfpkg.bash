@@ -29,15 +29,15 @@ _rfpkg()
     local options="--help -v -q"
     local options_value="--release --user --path --user-config --name --namespace"
     local commands="build chain-build ci clean clog clone co commit compile \
-    container-build diff gimmespec giturl help gitbuildhash import install lint \
+    container-build diff fetch-build gimmespec giturl help gitbuildhash import install lint \
     local mockbuild mock-config module-build module-build-cancel \
     module-build-local module-build-info module-build-watch module-overview \
     module-scratch-build \
-    new new-sources patch prep pull push retire request-branch request-repo \
+    new new-sources patch pkgdb-query pkgdb-sync prep pull push retire request-branch request-repo \
     request-tests-repo request-side-tag list-side-tags remove-side-tag \
-    scratch-build set-distgit-token set-pagure-token sources srpm switch-branch \
+    scratch-build serve set-distgit-token set-pagure-token sources srpm stats switch-branch \
     tag unused-patches update upload \
-    verify-files verrel override fork"
+    verify-files verrel override fork watch-tasks"
 
     # parse main options and get command
 
@@ -193,10 +193,27 @@ _rfpkg()
             options_yaml="--file"
             options_srpm="--srpm"
             ;;
+        fetch-build)
+            options="--no-rpms --no-logs"
+            options_arches="--arch"
+            options_string="--subpackage --log --jobs -j"
+            options_dir="--dest"
+            after_more=true
+            ;;
         patch)
             options="--rediff"
             options_string="--suffix"
             ;;
+        pkgdb-query)
+            options="--retired --active --refresh --json"
+            options_string="--branch"
+            options_namespace="--namespace"
+            after_more=true
+            ;;
+        pkgdb-sync)
+            options="--force"
+            options_namespace="--namespace"
+            ;;
         prep|verify-files)
             options_arches="--arch"
             options_dir="--builddir"
@@ -231,12 +248,20 @@ _rfpkg()
             options_arches="--arches"
             options_srpm="--srpm"
             ;;
+        serve)
+            options_string="--idle-timeout"
+            options_file="--socket"
+            ;;
         sources)
             options_dir="--outdir"
             ;;
         srpm)
             options="--md5"
             ;;
+        stats)
+            options_string="--since --kind --trend-days"
+            options_file="--prometheus"
+            ;;
         switch-branch)
             options="--list"
             after="branch"
@@ -247,6 +272,11 @@ _rfpkg()
             options_file="--file"
             after_more=true
             ;;
+        watch-tasks)
+            options="--json"
+            options_string="--poll-interval --max-interval"
+            after_more=true
+            ;;
         upload|new-sources)
             after="file"
             after_more=true
@@ -20,6 +20,7 @@ from six.moves.urllib_parse import urlparse
 
 from . import cli
 from .lookaside import RPMFusionLookasideCache
+from .metrics import recorder
 from pyrpkg.utils import cached_property
 
 
@@ -53,6 +54,8 @@ class Commands(pyrpkg.Commands):
         # New properties
         self._cert_file = None
         self._ca_cert = None
+        # Set by the client from the transfer_* configuration options
+        self.transfer_governor = None
 
         # RPM Fusion default namespace
         self.default_namespace = 'free'
@@ -119,7 +122,8 @@ class Commands(pyrpkg.Commands):
 
         return RPMFusionLookasideCache(
             self.lookasidehash, self.lookaside, self.lookaside_cgi,
-            client_cert=self._cert_file, ca_cert=self._ca_cert, namespace=self.namespace)
+            client_cert=self._cert_file, ca_cert=self._ca_cert, namespace=self.namespace,
+            governor=self.transfer_governor)
 
     # Overloaded property loaders
     def load_rpmdefines(self):
@@ -228,12 +232,15 @@ class Commands(pyrpkg.Commands):
 
         # If we already have a koji session, just get data from the source
         if self._kojisession:
-            rawhidetarget = self.kojisession.getBuildTarget('rawhide-free')
+            with recorder.measure('koji', 'getBuildTarget'):
+                rawhidetarget = self.kojisession.getBuildTarget('rawhide-free')
             return self._tag2version(rawhidetarget['dest_tag_name'])
 
         # We may not have Fedoras.  Find out what rawhide target does.
         try:
-            rawhidetarget = self.anon_kojisession.getBuildTarget('rawhide-free')
+            session = self.anon_kojisession
+            with recorder.measure('koji', 'getBuildTarget'):
+                rawhidetarget = session.getBuildTarget('rawhide-free')
         except:
             # We couldn't hit Koji. Continue, because rfpkg may work offline.
             self.log.debug('Unable to query Koji to find rawhide target. Continue offline.')
@@ -319,7 +326,8 @@ class Commands(pyrpkg.Commands):
 
     def load_kojisession(self, anon=False):
         try:
-            return super(Commands, self).load_kojisession(anon)
+            with recorder.measure('koji', 'load_kojisession'):
+                return super(Commands, self).load_kojisession(anon)
         except pyrpkg.rpkgAuthError:
             self.log.info("You might want to run rpmfusion-packager-setup "
                           "or rpmfusion-cert -n to regenerate SSL certificate. "
@@ -12,10 +12,12 @@
 import logging
 import os
 import sys
+import time
 
 import six
 
 import rfpkg
+import rfpkg.metrics
 import pyrpkg
 import pyrpkg.utils
 
@@ -30,9 +32,13 @@ else:
 cli_name = os.path.basename(sys.argv[0])
 
 
-def main():
-    default_user_config_path = os.path.join(
+def default_user_config_path():
+    return os.path.join(
         os.path.expanduser('~'), '.config', 'rpkg', '%s.conf' % cli_name)
+
+
+def parse_config_args(argv=None):
+    """Parse only the options needed to find the configuration files"""
     # Setup an argparser and parse the known commands to get the config file
     # - use the custom ArgumentParser class from pyrpkg.cli and disable
     #   argument abbreviation to ensure that --user will be not treated as
@@ -42,23 +48,28 @@ def main():
                         default='/etc/rpkg/%s.conf' % cli_name)
     parser.add_argument(
         '--user-config', help='Specify a user config file to use',
-        default=default_user_config_path)
+        default=default_user_config_path())
 
-    (args, other) = parser.parse_known_args()
+    return parser.parse_known_args(argv)
 
-    # Make sure we have a sane config file
-    if not os.path.exists(args.config) and \
-       not other[-1] in ['--help', '-h', 'help']:
-        sys.stderr.write('Invalid config file %s\n' % args.config)
-        sys.exit(1)
 
-    # Setup a configuration object and read config file data
+def load_config(config_path, user_config_path):
+    """Setup a configuration object and read config file data"""
     config = ConfigParser()
-    config.read(args.config)
-    config.read(args.user_config)
+    config.read(config_path)
+    config.read(user_config_path)
+    return config
+
 
+def load_client(config):
+    """Create the command line client for the given configuration"""
     client = rfpkg.cli.rfpkgClient(config, name=cli_name)
     client.do_imports(site='rfpkg')
+    return client
+
+
+def run(client):
+    """Parse sys.argv with the given client and run the requested command"""
     client.parse_cmdline()
 
     if not client.args.path:
@@ -83,18 +94,57 @@ def main():
     else:
         log.setLevel(logging.INFO)
 
+    rfpkg.metrics.recorder.configure(client.config, client.name)
+    rfpkg.metrics.recorder.command = client.args.command.__name__
+
     # Run the necessary command
+    start = time.time()
     try:
-        sys.exit(client.args.command())
-    except KeyboardInterrupt:
-        pass
+        try:
+            sys.exit(client.args.command())
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            log.error('Could not execute %s: %s' %
+                      (client.args.command.__name__, e))
+            if client.args.v:
+                raise
+            sys.exit(1)
+    finally:
+        _record_command(client, start)
+
+
+def _record_command(client, start):
+    """Store the metrics of the command, called while it exits"""
+    command = client.args.command.__name__
+    if command == 'serve':
+        # Runs for hours and would skew the statistics, the commands run by
+        # its workers are recorded by the workers
+        return
+    error = sys.exc_info()[1]
+    success = error is None or \
+        (isinstance(error, SystemExit) and not error.code)
+    recorder = rfpkg.metrics.recorder
+    recorder.record('command', command, time.time() - start,
+                    success=success, when=start)
+    try:
+        recorder.flush()
     except Exception as e:
-        log.error('Could not execute %s: %s' %
-                  (client.args.command.__name__, e))
-        if client.args.v:
-            raise
+        # Never fail a command because of its metrics
+        pyrpkg.log.debug('Could not store metrics: %s' % e)
+
+
+def main():
+    (args, other) = parse_config_args()
+
+    # Make sure we have a sane config file
+    if not os.path.exists(args.config) and \
+       not other[-1] in ['--help', '-h', 'help']:
+        sys.stderr.write('Invalid config file %s\n' % args.config)
         sys.exit(1)
 
+    run(load_client(load_config(args.config, args.user_config)))
+
 
 if __name__ == "__main__":
     main()
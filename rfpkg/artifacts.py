@@ -0,0 +1,317 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Download the RPMs and logs of a Koji build or task
+
+The outputs are resolved through the Koji session, then downloaded in
+parallel into one directory per build or task:
+
+    <dest>/<arch>/<rpm>
+    <dest>/logs/<arch>/<log>             for a build
+    <dest>/logs/<arch>/<task_id>/<log>   for a task
+
+Interrupted downloads are resumed from their ``.part`` file.  Every file is
+checked against the size known by Koji.  The digests of every RPM are
+checked with ``rpmkeys -K --nosignature``, which reads the whole file and
+fails if the header or the payload do not match the digests recorded in the
+package.  RPMs of builds must also carry the SIGMD5 Koji knows for them, and
+match the SHA-256 checksum the hub has for them, if any.
+"""
+
+
+import hashlib
+import os
+import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import koji
+import requests
+
+DEFAULT_JOBS = 4
+CHUNK_SIZE = 1024 * 1024
+# Seconds to connect, and to wait for data once connected
+DOWNLOAD_TIMEOUT = (30, 300)
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class Artifact(object):
+    def __init__(self, url, path, kind, arch, name=None, size=None,
+                 sigmd5=None, sha256=None):
+        self.url = url
+        # Relative to the destination directory
+        self.path = path
+        # 'rpm' or 'log'
+        self.kind = kind
+        self.arch = arch
+        # RPM name, or log type such as build or root
+        self.name = name
+        self.size = size
+        self.sigmd5 = sigmd5
+        self.sha256 = sha256
+
+    def __repr__(self):
+        return '<Artifact %s>' % self.path
+
+
+def _rpm_artifact(url, filename, size=None, sigmd5=None, sha256=None):
+    nvra = koji.parse_NVRA(filename)
+    return Artifact(url, os.path.join(nvra['arch'], filename), 'rpm',
+                    nvra['arch'], name=nvra['name'], size=size, sigmd5=sigmd5,
+                    sha256=sha256)
+
+
+def _log_artifact(url, filename, arch, size=None, task_id=None):
+    # Several tasks of the same arch all have a build.log
+    directory = os.path.join('logs', arch)
+    if task_id is not None:
+        directory = os.path.join(directory, str(task_id))
+    return Artifact(url, os.path.join(directory, filename), 'log', arch,
+                    name=filename[:-len('.log')] if filename.endswith('.log')
+                    else filename, size=size)
+
+
+def _unsigned_sha256(checksums):
+    """SHA-256 of the unsigned copy of an RPM from getRPMChecksums"""
+    try:
+        return checksums.result.get('', {}).get('sha256')
+    except koji.GenericError:
+        # Not known to older hubs
+        return None
+
+
+def resolve_build(session, topurl, nvr):
+    """Return the name of the build and its artifacts"""
+    pathinfo = koji.PathInfo(topdir=topurl)
+    build = session.getBuild(nvr, strict=True)
+    build_url = pathinfo.build(build)
+
+    with session.multicall(strict=True) as m:
+        rpms = m.listRPMs(buildID=build['id'])
+        logs = m.getBuildLogs(build['id'])
+    with session.multicall() as m:
+        checksums = [m.getRPMChecksums(rpm['id'], checksum_types=['sha256'],
+                                       cacheonly=True)
+                     for rpm in rpms.result]
+
+    artifacts = []
+    for rpm, rpm_checksums in zip(rpms.result, checksums):
+        filename = '%(name)s-%(version)s-%(release)s.%(arch)s.rpm' % rpm
+        artifacts.append(_rpm_artifact(
+            '%s/%s' % (build_url, pathinfo.rpm(rpm)), filename,
+            size=rpm.get('size'), sigmd5=rpm.get('payloadhash'),
+            sha256=_unsigned_sha256(rpm_checksums)))
+    for log in logs.result:
+        artifacts.append(_log_artifact(
+            '%s/%s' % (topurl.rstrip('/'), log['path']), log['name'],
+            log['dir']))
+    return build['nvr'], artifacts
+
+
+def resolve_task(session, topurl, task_id):
+    """Return the name of the task and the artifacts of it and its children"""
+    pathinfo = koji.PathInfo(topdir=topurl)
+    task = session.getTaskInfo(task_id, strict=True)
+    tasks = {task['id']: task}
+    for children in session.getTaskDescendents(task_id).values():
+        tasks.update((child['id'], child) for child in children)
+    # Oldest first, so that an RPM output by several tasks is taken from
+    # the one which built it
+    tasks = [tasks[t] for t in sorted(tasks)]
+
+    with session.multicall(strict=True) as m:
+        outputs = [m.listTaskOutput(t['id'], stat=True) for t in tasks]
+
+    artifacts = []
+    paths = set()
+    for t, output in zip(tasks, outputs):
+        task_url = '%s/%s' % (pathinfo.work(), pathinfo.taskrelpath(t['id']))
+        for filename, stat in sorted(output.result.items()):
+            url = '%s/%s' % (task_url, filename)
+            size = int(stat['st_size']) if 'st_size' in stat else None
+            if filename.endswith('.rpm'):
+                artifact = _rpm_artifact(url, filename, size=size)
+            elif filename.endswith('.log'):
+                artifact = _log_artifact(url, filename,
+                                         t.get('arch') or 'noarch',
+                                         size=size, task_id=t['id'])
+            else:
+                continue
+            # Two workers must never write the same file
+            if artifact.path not in paths:
+                paths.add(artifact.path)
+                artifacts.append(artifact)
+    return 'task-%d' % task_id, artifacts
+
+
+def select(artifacts, arches=None, subpackages=None, logs=None,
+           with_rpms=True, with_logs=True):
+    """Filter artifacts, None filters let everything through"""
+    selected = []
+    for artifact in artifacts:
+        if arches and artifact.arch not in arches:
+            continue
+        if artifact.kind == 'rpm':
+            if not with_rpms or \
+               (subpackages and artifact.name not in subpackages):
+                continue
+        elif not with_logs or (logs and artifact.name not in logs):
+            continue
+        selected.append(artifact)
+    return selected
+
+
+def sha256sum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def check_rpm_digests(path):
+    """Raise ArtifactError unless the digests stored in the RPM match
+
+    Signatures are not checked, the key of the signer may not be imported.
+    """
+    try:
+        proc = subprocess.Popen(['rpmkeys', '-K', '--nosignature', path],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError as e:
+        raise ArtifactError('Could not run rpmkeys to check %s: %s'
+                            % (path, e))
+    output, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise ArtifactError('%s: digests do not match: %s'
+                            % (path, output.decode('utf-8', 'replace')
+                               .strip()))
+
+
+def verify(artifact, path):
+    """Raise ArtifactError if the file does not match what Koji knows"""
+    if artifact.size is not None and os.path.getsize(path) != artifact.size:
+        raise ArtifactError('%s: size %d does not match expected %d'
+                            % (path, os.path.getsize(path), artifact.size))
+    if artifact.sha256 and sha256sum(path) != artifact.sha256:
+        raise ArtifactError('%s: SHA-256 checksum does not match expected %s'
+                            % (path, artifact.sha256))
+    if artifact.kind != 'rpm':
+        return
+    if artifact.sigmd5:
+        # The RPM Koji knows, and not another build of the same NVRA
+        try:
+            header = koji.get_rpm_header(path)
+            sigmd5 = koji.hex_string(koji.get_header_field(header, 'sigmd5'))
+        except Exception as e:
+            # rpm.error for a corrupt header, koji.GenericError without
+            # the rpm bindings
+            raise ArtifactError('%s: could not read the RPM header: %s'
+                                % (path, e))
+        if sigmd5 != artifact.sigmd5:
+            raise ArtifactError('%s: SIGMD5 %s does not match expected %s'
+                                % (path, sigmd5, artifact.sigmd5))
+    check_rpm_digests(path)
+
+
+class Downloader(object):
+    def __init__(self, dest, log, jobs=DEFAULT_JOBS,
+                 timeout=DOWNLOAD_TIMEOUT):
+        self.dest = dest
+        self.log = log
+        self.jobs = jobs
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests sessions are not thread safe, one per worker
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def fetch(self, artifact):
+        """Download one artifact unless a valid copy is already there"""
+        path = os.path.join(self.dest, artifact.path)
+        if os.path.exists(path):
+            try:
+                verify(artifact, path)
+                self.log.debug('%s is already downloaded' % artifact.path)
+                return path
+            except ArtifactError:
+                os.unlink(path)
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another worker in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+        part = path + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if artifact.size is not None and offset > artifact.size:
+            offset = 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        response = self.session.get(artifact.url, headers=headers,
+                                    stream=True, timeout=self.timeout)
+        try:
+            if response.status_code == 416 and offset:
+                # The part file is already complete
+                pass
+            elif response.status_code in (200, 206):
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            else:
+                raise ArtifactError('Could not download %s: HTTP %d'
+                                    % (artifact.url, response.status_code))
+        finally:
+            response.close()
+
+        try:
+            verify(artifact, part)
+        except Exception:
+            # Do not resume from corrupted data next time
+            os.unlink(part)
+            raise
+        os.rename(part, path)
+        self.log.info('Downloaded %s' % artifact.path)
+        return path
+
+    def download(self, artifacts):
+        """Download all artifacts, return the list of errors"""
+        errors = []
+        futures = []
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            for artifact in artifacts:
+                futures.append((artifact, pool.submit(self.fetch, artifact)))
+            for artifact, future in futures:
+                try:
+                    future.result()
+                except (ArtifactError, requests.RequestException,
+                        EnvironmentError) as e:
+                    self.log.error('Failed to download %s: %s'
+                                   % (artifact.path, e))
+                    errors.append(e)
+        finally:
+            # On Ctrl-C or an unexpected error, only wait for the running
+            # downloads
+            for _, future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+        return errors
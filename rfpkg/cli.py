@@ -14,28 +14,41 @@
 from __future__ import print_function
 
 import argparse
+import json
 import sys
+import time
 import os
 import logging
 import six
 import textwrap
+import requests
 
 if six.PY3:
     import rfpkgdb2client
 else:
     import pkgdb2client as rfpkgdb2client
 
+from pyrpkg import rpkgError
 from pyrpkg.cli import cliClient
 
+from . import governor, metrics, pkgdb_cache
+from .daemon import DEFAULT_IDLE_TIMEOUT
+
 RELEASE_BRANCH_REGEX = r'^(f\d+|el\d+|epel\d+)$'
 LOCAL_PACKAGE_CONFIG = 'package.cfg'
 
 class rfpkgClient(cliClient):
     def __init__(self, config, name=None):
         self.DEFAULT_CLI_NAME = 'rfpkg'
+        self._pkgdb_cache = None
         super(rfpkgClient, self).__init__(config, name)
         self.setup_fed_subparsers()
 
+    def load_cmd(self):
+        super(rfpkgClient, self).load_cmd()
+        self._cmd.transfer_governor = governor.from_config(
+            self.config, self.name, log=self.log)
+
     def setup_argparser(self):
         super(rfpkgClient, self).setup_argparser()
 
@@ -60,6 +73,221 @@ class rfpkgClient(cliClient):
         # bodhi instance to send update requests to
         #self.register_update()
 
+        self.register_serve()
+        self.register_pkgdb_sync()
+        self.register_pkgdb_query()
+        self.register_watch_tasks()
+        self.register_fetch_build()
+        self.register_stats()
+
+    def register_serve(self):
+        """Register the serve target"""
+
+        serve_parser = self.subparsers.add_parser(
+            'serve',
+            help='Run a per-user rfpkg daemon answering rfpkgc requests',
+            description='Keep configuration, argument parser and imported '
+                        'modules in memory and run the commands forwarded by '
+                        'the rfpkgc client in forked workers. The daemon '
+                        'only accepts connections from the user running it '
+                        'and exits after a period of inactivity. Workers '
+                        'have no controlling terminal: commands which may '
+                        'prompt on /dev/tty, like ssh asking for a key '
+                        'passphrase during clone, pull, push or retire, are '
+                        'run by rfpkgc with the regular rfpkg instead.')
+        serve_parser.add_argument(
+            '--idle-timeout', type=int, default=None,
+            help='Seconds without request before the daemon exits. Defaults '
+                 'to daemon_idle_timeout from the configuration, or %d.'
+                 % DEFAULT_IDLE_TIMEOUT)
+        serve_parser.add_argument(
+            '--socket', default=None,
+            help='Path of the Unix socket to listen on')
+        serve_parser.set_defaults(command=self.serve)
+
+    def register_pkgdb_sync(self):
+        """Register the pkgdb-sync target"""
+
+        sync_parser = self.subparsers.add_parser(
+            'pkgdb-sync',
+            help='Update the local cache of pkgdb package metadata',
+            description='Download branches, retired status and ACLs of all '
+                        'packages of the given namespaces into the local '
+                        'pkgdb cache. Namespaces synced less than '
+                        'pkgdb_cache_ttl seconds ago are skipped and pages '
+                        'which did not change are not transferred again.')
+        sync_parser.add_argument(
+            '--namespace', action='append', choices=pkgdb_cache.NAMESPACES,
+            help='Namespace to sync, can be repeated. Defaults to all.')
+        sync_parser.add_argument(
+            '--force', action='store_true', default=False,
+            help='Sync even if the cached data did not expire yet')
+        sync_parser.set_defaults(command=self.pkgdb_sync)
+
+    def register_pkgdb_query(self):
+        """Register the pkgdb-query target"""
+
+        query_parser = self.subparsers.add_parser(
+            'pkgdb-query',
+            help='Show branches and retired status from the pkgdb cache',
+            description='Print one line per package and branch found in the '
+                        'local pkgdb cache. Named packages which are not '
+                        'cached or expired are fetched from pkgdb, listing '
+                        'all packages only uses data from pkgdb-sync.')
+        query_parser.add_argument(
+            'package', nargs='*',
+            help='Packages to show. Defaults to all cached packages.')
+        query_parser.add_argument(
+            '--namespace', action='append', choices=pkgdb_cache.NAMESPACES,
+            help='Only show this namespace, can be repeated')
+        query_parser.add_argument(
+            '--branch', help='Only show this branch, e.g. f40 or master')
+        status_group = query_parser.add_mutually_exclusive_group()
+        status_group.add_argument(
+            '--retired', action='store_true', default=False,
+            help='Only show retired branches')
+        status_group.add_argument(
+            '--active', action='store_true', default=False,
+            help='Only show branches which are not retired')
+        query_parser.add_argument(
+            '--refresh', action='store_true', default=False,
+            help='Fetch named packages from pkgdb even if they are cached')
+        query_parser.add_argument(
+            '--json', action='store_true', default=False,
+            help='Print the cache entries, including ACLs, as JSON')
+        query_parser.set_defaults(command=self.pkgdb_query)
+
+    def register_watch_tasks(self):
+        """Register the watch-tasks target"""
+
+        watch_parser = self.subparsers.add_parser(
+            'watch-tasks',
+            help='Watch several Koji tasks until they are finished',
+            description='Watch Koji tasks and their subtasks over a single '
+                        'session. Tasks are queried together with one '
+                        'multicall, and tasks which did not change are '
+                        'polled less often. Exits with 1 if any task did '
+                        'not succeed.')
+        watch_parser.add_argument(
+            'task_id', nargs='+', type=int, help='Koji task IDs to watch')
+        watch_parser.add_argument(
+            '--json', action='store_true', default=False,
+            help='Print every state transition as a JSON object per line')
+        watch_parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help='Initial seconds between two polls of a task')
+        watch_parser.add_argument(
+            '--max-interval', type=float, default=None,
+            help='Maximum seconds between two polls of a task which does '
+                 'not change')
+        watch_parser.set_defaults(command=self.watch_tasks)
+
+    def register_fetch_build(self):
+        """Register the fetch-build target"""
+
+        fetch_parser = self.subparsers.add_parser(
+            'fetch-build',
+            help='Download the RPMs and logs of a Koji build or task',
+            description='Download the RPMs and logs of a build, given by '
+                        'its NVR, or of a task and its subtasks, given by '
+                        'its ID. Files are downloaded in parallel into '
+                        '<dest>/<arch>/ and <dest>/logs/<arch>/, with one '
+                        'log directory per task for tasks. Interrupted '
+                        'downloads are resumed, files are verified against '
+                        'the data known by Koji and RPM digests are checked '
+                        'with rpmkeys.')
+        fetch_parser.add_argument(
+            'build', help='NVR of a build or ID of a task')
+        fetch_parser.add_argument(
+            '--arch', action='append', dest='arches', default=None,
+            help='Only download this arch, e.g. x86_64 or src. Can be '
+                 'repeated.')
+        fetch_parser.add_argument(
+            '--subpackage', action='append', dest='subpackages',
+            default=None,
+            help='Only download RPMs of this subpackage. Can be repeated.')
+        fetch_parser.add_argument(
+            '--log', action='append', dest='logs', default=None,
+            help='Only download this log type, e.g. build or root. Can be '
+                 'repeated.')
+        fetch_parser.add_argument(
+            '--no-rpms', action='store_true', default=False,
+            help='Do not download RPMs')
+        fetch_parser.add_argument(
+            '--no-logs', action='store_true', default=False,
+            help='Do not download logs')
+        fetch_parser.add_argument(
+            '--dest', default=None,
+            help='Directory to download into. Defaults to the NVR, or '
+                 'task-<ID>, in the current directory.')
+        fetch_parser.add_argument(
+            '--jobs', '-j', type=int, default=None,
+            help='Number of parallel downloads')
+        fetch_parser.set_defaults(command=self.fetch_build)
+
+    def register_stats(self):
+        """Register the stats target"""
+
+        stats_parser = self.subparsers.add_parser(
+            'stats',
+            help='Report how long rfpkg operations took',
+            description='Print percentiles of the durations recorded in the '
+                        'metrics database, per kind of operation: command, '
+                        'download, upload, hash and koji. The trend compares '
+                        'the median of the last --trend-days with the same '
+                        'period before. Recording is enabled with the '
+                        'metrics option of the configuration file.')
+        stats_parser.add_argument(
+            '--since', type=float, default=30,
+            help='Only use measurements of the last SINCE days, defaults '
+                 'to 30')
+        stats_parser.add_argument(
+            '--kind', choices=('command', 'download', 'upload', 'hash',
+                               'koji'),
+            help='Only report this kind of operation')
+        stats_parser.add_argument(
+            '--trend-days', type=float, default=7,
+            help='Length in days of the periods compared for the trend, '
+                 'defaults to 7')
+        stats_parser.add_argument(
+            '--prometheus', metavar='FILE', default=None,
+            help='Write the statistics to FILE in the Prometheus textfile '
+                 'format instead of printing them. Counters cover every '
+                 'operation ever recorded, quantiles and throughput only '
+                 'the last SINCE days')
+        stats_parser.set_defaults(command=self.stats)
+
+    def _config_float(self, option, default):
+        if self.config.has_option(self.name, option):
+            return self.config.getfloat(self.name, option)
+        return default
+
+    def _config_int(self, option, default):
+        if self.config.has_option(self.name, option):
+            return self.config.getint(self.name, option)
+        return default
+
+    @property
+    def pkgdb_url(self):
+        if self.config.has_option(self.name, 'pkgdb_url'):
+            return self.config.get(self.name, 'pkgdb_url')
+        return pkgdb_cache.PKGDB_URL
+
+    @property
+    def pkgdb_cache(self):
+        """The local pkgdb metadata cache, configured from the config file"""
+        if self._pkgdb_cache is None:
+            ttl = pkgdb_cache.DEFAULT_TTL
+            if self.config.has_option(self.name, 'pkgdb_cache_ttl'):
+                ttl = self.config.getint(self.name, 'pkgdb_cache_ttl')
+            path = None
+            if self.config.has_option(self.name, 'pkgdb_cache'):
+                path = os.path.expanduser(
+                    self.config.get(self.name, 'pkgdb_cache'))
+            self._pkgdb_cache = pkgdb_cache.PkgDBCache(
+                path=path, url=self.pkgdb_url, ttl=ttl)
+        return self._pkgdb_cache
+
     # Target functions go here
     def _format_update_clog(self, clog):
         ''' Format clog for the update template. '''
@@ -75,11 +303,240 @@ class rfpkgClient(cliClient):
         log.append('#')
         return lines[0], "\n".join(log)
 
+    def serve(self):
+        from .__main__ import parse_config_args
+        from .daemon import Server
+
+        idle_timeout = self.args.idle_timeout
+        if idle_timeout is None:
+            if self.config.has_option(self.name, 'daemon_idle_timeout'):
+                idle_timeout = self.config.getint(self.name,
+                                                  'daemon_idle_timeout')
+            else:
+                idle_timeout = DEFAULT_IDLE_TIMEOUT
+        config_args, _ = parse_config_args(sys.argv[1:])
+        server = Server(config_args, self.log, idle_timeout=idle_timeout,
+                        socket_path=self.args.socket)
+        server.serve_forever()
+
+    def pkgdb_sync(self):
+        cache = self.pkgdb_cache
+        try:
+            for namespace in self.args.namespace or pkgdb_cache.NAMESPACES:
+                count = cache.sync(namespace, force=self.args.force)
+                if count is None:
+                    self.log.info('Cached data of %s is up to date' % namespace)
+                else:
+                    self.log.info('Synced %d packages of %s' % (count, namespace))
+        finally:
+            # Keep what was fetched even if a later page failed
+            cache.save()
+        self.log.debug('%d requests sent to pkgdb, %d not modified'
+                       % (cache.requests, cache.not_modified))
+
+    def pkgdb_query(self):
+        cache = self.pkgdb_cache
+        namespaces = self.args.namespace or pkgdb_cache.NAMESPACES
+        if self.args.package:
+            entries = []
+            try:
+                for name in self.args.package:
+                    for namespace in namespaces:
+                        entry = cache.refresh(namespace, name,
+                                              force=self.args.refresh)
+                        if entry is not None:
+                            entries.append(entry)
+            finally:
+                cache.save()
+        else:
+            entries = []
+            for namespace in namespaces:
+                if not cache.is_synced(namespace):
+                    self.log.warning('Cached data of %s is missing or expired, '
+                                     'run pkgdb-sync to update it' % namespace)
+                entries.extend(cache.entries(namespace))
+
+        results = []
+        for entry in entries:
+            branches = {}
+            for branch, info in sorted(entry['branches'].items()):
+                if self.args.branch and branch != self.args.branch:
+                    continue
+                retired = info['status'] == pkgdb_cache.RETIRED
+                if (self.args.retired and not retired) or \
+                   (self.args.active and retired):
+                    continue
+                branches[branch] = info
+            if branches:
+                results.append(dict(entry, branches=branches))
+
+        if self.args.json:
+            print(json.dumps(results, indent=2, sort_keys=True))
+            return
+        for entry in results:
+            for branch, info in sorted(entry['branches'].items()):
+                print('%s/%s %s %s' % (entry['namespace'], entry['name'],
+                                       branch, info['status']))
+
+    def _run_task_watcher(self, session, task_ids, on_event, results=True):
+        from . import watch
+
+        # build and friends do not have the watch-tasks options
+        poll_interval = getattr(self.args, 'poll_interval', None)
+        if poll_interval is None:
+            poll_interval = self._config_float('watch_poll_interval',
+                                               watch.DEFAULT_POLL_INTERVAL)
+        max_interval = getattr(self.args, 'max_interval', None)
+        if max_interval is None:
+            max_interval = self._config_float('watch_max_interval',
+                                              watch.DEFAULT_MAX_INTERVAL)
+        # Summary of the root tasks, as pyrpkg prints after watching them
+        results_log = self.log if results and not self.args.q else None
+        try:
+            return watch.watch_tasks(session, task_ids, on_event=on_event,
+                                     results_log=results_log,
+                                     poll_interval=poll_interval,
+                                     max_interval=max_interval)
+        except watch.UnknownTaskError as e:
+            raise rpkgError(str(e))
+        except KeyboardInterrupt:
+            self.log.info('Tasks still running. You can continue to watch '
+                          'with the \'%s watch-tasks %s\' command.'
+                          % (self.name, ' '.join(str(t) for t in task_ids)))
+            raise
+
+    def _watch_build_tasks(self, task_ids):
+        """Watch the tasks submitted by build, scratch-build or chain-build
+
+        Replaces the koji_cli watch loop used by pyrpkg, which polls every
+        task on its own, with the batching watcher of rfpkg.  --nowait and
+        --dry-run are honoured like pyrpkg does.
+        """
+        from . import watch
+
+        if getattr(self.args, 'nowait', False):
+            return
+        if getattr(self.args, 'dry_run', False):
+            self.log.info('DRY-RUN: Watch tasks: %s', task_ids)
+            return
+        self.log.info('Watching tasks (this may be safely interrupted)...')
+        try:
+            return self._run_task_watcher(self.cmd.kojisession, task_ids,
+                                          watch.text_printer(self.log))
+        except requests.exceptions.ConnectionError as e:
+            self.log.error('Could not finish the \'watch task\'. Reason: %s',
+                           e)
+            sys.exit(2)
+
+    def watch_tasks(self):
+        from . import watch
+
+        if self.args.json:
+            on_event = watch.json_printer()
+        else:
+            on_event = watch.text_printer(self.log)
+        return self._run_task_watcher(self.cmd.anon_kojisession,
+                                      self.args.task_id, on_event,
+                                      results=not self.args.json)
+
+    def fetch_build(self):
+        from . import artifacts
+
+        session = self.cmd.anon_kojisession
+        topurl = self.cmd.topurl
+        if self.args.build.isdigit():
+            name, found = artifacts.resolve_task(session, topurl,
+                                                 int(self.args.build))
+        else:
+            name, found = artifacts.resolve_build(session, topurl,
+                                                  self.args.build)
+        selected = artifacts.select(
+            found, arches=self.args.arches,
+            subpackages=self.args.subpackages, logs=self.args.logs,
+            with_rpms=not self.args.no_rpms, with_logs=not self.args.no_logs)
+        if not selected:
+            raise rpkgError('Nothing to download from %s' % name)
+
+        jobs = self.args.jobs
+        if jobs is None:
+            jobs = self._config_int('fetch_jobs', artifacts.DEFAULT_JOBS)
+        dest = self.args.dest or os.path.join(os.getcwd(), name)
+        self.log.info('Downloading %d files of %s into %s'
+                      % (len(selected), name, dest))
+        downloader = artifacts.Downloader(dest, self.log, jobs=jobs)
+        errors = downloader.download(selected)
+        if errors:
+            raise rpkgError('%d of %d files could not be downloaded'
+                            % (len(errors), len(selected)))
+
+    def stats(self):
+        path = metrics.recorder.path or metrics.default_db_path()
+        if not os.path.exists(path):
+            self.log.info('No measurement recorded, enable the metrics '
+                          'option of the configuration file to record them')
+            return
+        store = metrics.MetricsStore(path, readonly=True)
+        try:
+            window = self.args.since * metrics.DAY
+            summaries = store.summary(since=time.time() - window,
+                                      kind=self.args.kind)
+            if self.args.prometheus:
+                metrics.export_prometheus(store.totals(kind=self.args.kind),
+                                          summaries, window,
+                                          self.args.prometheus)
+                return
+            trends = store.trends(self.args.trend_days * metrics.DAY,
+                                  kind=self.args.kind)
+        finally:
+            store.close()
+
+        if not summaries:
+            self.log.info('No measurement recorded in the last %g days'
+                          % self.args.since)
+            return
+        row = '%-8s %-28s %6s %9s %9s %9s %11s %7s'
+        print(row % ('KIND', 'NAME', 'COUNT', 'P50', 'P90', 'P99',
+                     'RATE', 'TREND'))
+        for stats in summaries:
+            quantiles = ['%.3fs' % stats['quantiles'][q]
+                         for q in metrics.QUANTILES]
+            rate = '-'
+            if stats['throughput'] is not None:
+                rate = '%.2fMB/s' % (stats['throughput'] / 1024 ** 2)
+            trend = trends.get((stats['kind'], stats['name']))
+            trend = '-' if trend is None else '%+.0f%%' % (trend * 100)
+            print(row % tuple([stats['kind'], stats['name'], stats['count']]
+                              + quantiles + [rate, trend]))
+
+    def _refresh_pkgdb_entry(self, cache, namespace, name):
+        """Fetch the pkgdb entry of a package, None if it cannot be done"""
+        try:
+            entry = cache.refresh(namespace, name, force=True)
+        except pkgdb_cache.PkgDBCacheError as e:
+            self.log.warning('Could not check %s/%s in pkgdb: %s'
+                             % (namespace, name, e))
+            return None
+        cache.save()
+        return entry
+
     def retire(self):
         try:
             repo_name = self.cmd.repo_name
             ns_repo_name = self.cmd.ns_repo_name
             namespace = ns_repo_name.split(repo_name)[0].rstrip('/')
+            branch = self.cmd.branch_merge
+            # Validate with the local pkgdb cache before touching git. The
+            # cache may be up to pkgdb_cache_ttl old, so whatever would stop
+            # the retirement is confirmed with pkgdb first.
+            cache = self.pkgdb_cache
+            entry = cache.get(namespace, repo_name)
+            if entry is not None and (
+                    branch not in entry['branches'] or
+                    pkgdb_cache.is_retired(entry, branch)):
+                entry = self._refresh_pkgdb_entry(cache, namespace, repo_name)
+            if entry is not None and branch not in entry['branches']:
+                raise rpkgError('branch %s of %s does not exist in pkgdb'
+                                % (branch, ns_repo_name))
             # Skip if package is already retired to allow to retire only in
             # pkgdb
             if os.path.isfile(os.path.join(self.cmd.path, 'dead.package')):
@@ -90,10 +547,15 @@ class rfpkgClient(cliClient):
                 self.cmd.retire(self.args.reason)
                 self.push()
 
-            branch = self.cmd.branch_merge
+            if entry is not None and pkgdb_cache.is_retired(entry, branch):
+                self.log.info('%s is already retired on %s in pkgdb'
+                              % (ns_repo_name, branch))
+                return
             pkgdb = rfpkgdb2client.PkgDB(
-                login_callback=rfpkgdb2client.ask_password, url="https://admin.rpmfusion.org/pkgdb")
+                login_callback=rfpkgdb2client.ask_password, url=self.pkgdb_url)
             pkgdb.retire_packages(repo_name, branch, namespace=namespace)
+            if cache.mark_retired(namespace, repo_name, branch):
+                cache.save()
         except Exception as e:
             self.log.error('Could not retire package: %s' % e)
             sys.exit(1)
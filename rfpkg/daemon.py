@@ -0,0 +1,259 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Keep rfpkg warm in a per-user background process
+
+``rfpkg serve`` imports everything, reads the configuration files and builds
+the argument parser once, then forks a worker for every request received on
+a Unix socket.  The worker takes over the working directory, environment and
+standard file descriptors of the ``rfpkgc`` client and runs the command line
+exactly as ``rfpkg`` would.  Koji and lookaside sessions are still created
+by each worker: they depend on the command line and must not be shared
+between forked processes.
+
+Workers lead a session of their own so that the client can signal all of
+their processes at once.  They have no controlling terminal, which is why
+``rfpkgc`` does not forward the commands which may prompt on /dev/tty.
+"""
+
+
+import errno
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+
+import pyrpkg
+
+import rfpkg_client
+
+DEFAULT_IDLE_TIMEOUT = 900
+# How often finished workers are reaped while some are running
+REAP_INTERVAL = 1.0
+# How long a connected client has to send its request
+REQUEST_TIMEOUT = 5.0
+
+# Modules imported lazily by rfpkg commands, loaded up front so that every
+# worker gets them for free
+PRELOAD_MODULES = ('koji', 'koji_cli.lib', 'pycurl', 'rpm', 'OpenSSL')
+
+
+class Server(object):
+    def __init__(self, config_args, log, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 socket_path=None):
+        self.config_args = (config_args.config, config_args.user_config)
+        self.log = log
+        self.idle_timeout = idle_timeout
+        self.socket_path = socket_path or rfpkg_client.socket_path()
+        self.workers = set()
+        self._sock = None
+        self._client = None
+        self._config_mtimes = None
+
+    def _get_config_mtimes(self):
+        mtimes = []
+        for path in self.config_args:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def warm_client(self):
+        """Return the client, recreating it when a config file changed"""
+        from .__main__ import load_client, load_config
+
+        mtimes = self._get_config_mtimes()
+        if self._client is None or mtimes != self._config_mtimes:
+            self.log.debug('Loading configuration from %s',
+                           ', '.join(self.config_args))
+            self._client = load_client(load_config(*self.config_args))
+            self._config_mtimes = mtimes
+        return self._client
+
+    def preload(self):
+        for name in PRELOAD_MODULES:
+            try:
+                __import__(name)
+            except ImportError:
+                self.log.debug('Could not preload %s', name)
+
+    def bind(self):
+        rfpkg_client.ensure_runtime_dir(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            if rfpkg_client.connect(self.socket_path) is not None:
+                raise pyrpkg.rpkgError(
+                    'An rfpkg daemon is already listening on %s'
+                    % self.socket_path)
+            # Left behind by a daemon that was killed
+            os.unlink(self.socket_path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        self._sock = sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def reap(self):
+        for pid in list(self.workers):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                done = pid
+            if done:
+                self.workers.discard(pid)
+
+    def serve_forever(self):
+        self.preload()
+        self.warm_client()
+        self.bind()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.log.info('Listening on %s, exiting after %d seconds of '
+                      'inactivity', self.socket_path, self.idle_timeout)
+
+        last_activity = time.time()
+        try:
+            while True:
+                self.reap()
+                if self.workers:
+                    timeout = REAP_INTERVAL
+                else:
+                    timeout = last_activity + self.idle_timeout - time.time()
+                    if timeout <= 0:
+                        self.log.info('No request for %d seconds, exiting',
+                                      self.idle_timeout)
+                        break
+                readable, _, _ = select.select([self._sock], [], [], timeout)
+                if not readable:
+                    continue
+                conn, _ = self._sock.accept()
+                last_activity = time.time()
+                try:
+                    self.handle(conn)
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def peer_allowed(self, conn):
+        """Only serve processes running as the user owning the daemon"""
+        if not hasattr(socket, 'SO_PEERCRED'):
+            # The socket directory permissions still protect us
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid == os.getuid()
+
+    def handle(self, conn):
+        if not self.peer_allowed(conn):
+            self.log.warning('Refusing connection from another user')
+            return
+
+        # A client which never sends its request must not block the
+        # accept loop for everybody else
+        conn.settimeout(REQUEST_TIMEOUT)
+        reader = rfpkg_client.MessageReader(conn)
+        try:
+            request = reader.read()
+        except socket.timeout:
+            self.log.warning('No request received within %g seconds',
+                             REQUEST_TIMEOUT)
+            request = None
+        except ValueError as e:
+            self.log.warning('Ignoring malformed request: %s', e)
+            request = None
+        conn.settimeout(None)
+        if request is None or len(reader.fds) != rfpkg_client.MAX_FDS:
+            for fd in reader.fds:
+                os.close(fd)
+            return
+
+        client = self.warm_client()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = self.run_worker(client, request, reader.fds, conn)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+
+        self.workers.add(pid)
+        for fd in reader.fds:
+            os.close(fd)
+
+    def run_worker(self, client, request, fds, conn):
+        """Run one command line in the forked worker, return its status"""
+        from .__main__ import cli_name, load_client, load_config, \
+            parse_config_args, run
+
+        self._sock.close()
+        # Lead a process group of our own, so that the client can signal
+        # the worker together with rpmbuild, mock, git or the editor it runs
+        os.setsid()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.umask(request['umask'])
+        rfpkg_client.send_message(conn, {'pid': os.getpid()})
+
+        argv = request['argv']
+        config_args, _ = parse_config_args(argv)
+        if (config_args.config, config_args.user_config) != self.config_args:
+            if not os.path.exists(config_args.config):
+                sys.stderr.write('Invalid config file %s\n'
+                                 % config_args.config)
+                return 1
+            client = load_client(load_config(config_args.config,
+                                             config_args.user_config))
+
+        # The handlers of the daemon itself, run() sets them up again
+        del pyrpkg.log.handlers[:]
+        sys.argv = [cli_name] + argv
+        try:
+            run(client)
+            status = 0
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                sys.stderr.write('%s\n' % e.code)
+                status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        rfpkg_client.send_message(conn, {'status': status})
+        return status
@@ -0,0 +1,343 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Share lookaside bandwidth and transfer slots between rfpkg processes
+
+All the rfpkg processes of a host cooperate through files in a shared
+directory:
+
+- ``slot-N`` files, locked with flock(), cap the number of concurrent
+  transfers.  Background processes may not use the last reserved slots, so
+  an interactive command never waits behind a prefetch.
+- ``bucket`` holds a token bucket limiting the aggregated rate, protected by
+  flock() as well.  Interactive transfers mark the bucket as busy, and
+  background transfers pause as long as it is, up to MAX_BACKGROUND_PAUSE
+  after which they go on at a fraction of the rate.
+
+Locks held by a process are released by the kernel when it dies, so a
+crashed rfpkg never leaks a slot.
+
+The directory defaults to /run/rfpkg, created at boot by root through the
+tmpfiles.d configuration shipped with rfpkg.  Any user can write to it, so
+it must be owned by root or the current user and have the sticky bit set
+when others can write to it, and only regular files are opened in it,
+never following symbolic links.  When the directory is not safe, transfers
+are not governed at all.  Everything read from the shared files is
+validated: another user can write anything in them.
+"""
+
+
+import contextlib
+import errno
+import fcntl
+import math
+import os
+import stat
+import struct
+import time
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+DEFAULT_RESERVED_SLOTS = 1
+# Size of the bucket, in seconds of transfer at the configured rate
+BURST_SECONDS = 1.0
+# Background transfers stay paused this long after the last interactive one
+INTERACTIVE_HOLD = 2.0
+POLL_INTERVAL = 0.25
+# Longest a background transfer waits for interactive ones to finish
+MAX_BACKGROUND_PAUSE = 30.0
+# Share of the rate left to background transfers after that
+BACKGROUND_SHARE = 0.1
+# Longest sleep for a single chunk, whatever the shared state says
+MAX_SLEEP = 5.0
+DEFAULT_DIRECTORY = '/run/rfpkg'
+
+# tokens, last refill, interactive transfers active until
+_BUCKET = struct.Struct('=ddd')
+_SIZE_SUFFIXES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+class UnsafeDirectoryError(Exception):
+    pass
+
+
+def parse_rate(value):
+    """Parse a rate in bytes per second, with optional K, M or G suffix"""
+    value = value.strip().lower()
+    if value.endswith('/s'):
+        value = value[:-2]
+    if value.endswith('b'):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[value[-1]]
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def _check_directory(path):
+    """Raise UnsafeDirectoryError unless other users cannot tamper with path
+
+    Like /tmp, a directory writable by others must be sticky, so that they
+    cannot replace the files of another user.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise UnsafeDirectoryError('%s is not a directory' % path)
+    if st.st_uid not in (0, os.getuid()):
+        raise UnsafeDirectoryError('%s is owned by uid %d, neither root nor '
+                                   'the current user' % (path, st.st_uid))
+    if st.st_mode & 0o022 and not st.st_mode & stat.S_ISVTX:
+        raise UnsafeDirectoryError('%s is writable by others and not sticky'
+                                   % path)
+
+
+def _open_shared(path):
+    """Open a file every user of the host can lock and write
+
+    Symbolic links and hard links, which another user could point to a file
+    of ours, are refused.
+    """
+    flags = os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0) | \
+        getattr(os, 'O_CLOEXEC', 0)
+    try:
+        try:
+            fd = os.open(path, flags)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            try:
+                fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o666)
+                os.fchmod(fd, 0o666)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                # Created by another process in the meantime. Not opening it
+                # with O_CREAT, which protected_regular refuses for the files
+                # of other users in a sticky directory.
+                fd = os.open(path, flags)
+    except OSError as e:
+        if e.errno == errno.ELOOP:
+            raise UnsafeDirectoryError('%s is a symbolic link' % path)
+        raise
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink != 1:
+        os.close(fd)
+        raise UnsafeDirectoryError('%s is not a regular file' % path)
+    return fd
+
+
+def _clamp(value, low, high, default):
+    if math.isnan(value):
+        return default
+    return min(max(value, low), high)
+
+
+class TransferGovernor(object):
+    def __init__(self, directory=None, rate=0, max_transfers=0,
+                 reserved_slots=DEFAULT_RESERVED_SLOTS, priority=INTERACTIVE,
+                 log=None, clock=time.time, sleep=time.sleep):
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown transfer priority %s, use one of %s'
+                             % (priority, ', '.join(PRIORITIES)))
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.rate = rate
+        self.max_transfers = max_transfers
+        self.reserved_slots = reserved_slots
+        self.priority = priority
+        self.log = log
+        self.clock = clock
+        self.sleep = sleep
+        self._bucket_fd = None
+        # None until the directory is checked, then whether it is usable
+        self._usable = None
+        self._paused_since = None
+
+    def _ensure_directory(self):
+        """Return whether the shared directory exists and is safe to use"""
+        if self._usable is None:
+            try:
+                try:
+                    os.mkdir(self.directory)
+                    # Sticky and world writable, like /tmp
+                    os.chmod(self.directory, 0o1777)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                _check_directory(self.directory)
+                self._usable = True
+            except (OSError, UnsafeDirectoryError) as e:
+                if self.log is not None:
+                    self.log.warning('Not limiting transfers, cannot use '
+                                     '%s: %s' % (self.directory, e))
+                self._usable = False
+        return self._usable
+
+    @property
+    def slot_count(self):
+        """Number of slots this process is allowed to take"""
+        if self.priority == INTERACTIVE:
+            return self.max_transfers
+        return max(1, self.max_transfers - self.reserved_slots)
+
+    def _try_slots(self):
+        for index in range(self.slot_count):
+            fd = _open_shared(os.path.join(self.directory, 'slot-%d' % index))
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except (IOError, OSError) as e:
+                os.close(fd)
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        return None
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the host-wide transfer slots"""
+        if not self.max_transfers or not self._ensure_directory():
+            yield
+            return
+        try:
+            fd = self._try_slots()
+            if fd is None and self.log is not None:
+                self.log.info('Waiting for one of the %d transfer slots of '
+                              'this host' % self.max_transfers)
+            while fd is None:
+                self.sleep(POLL_INTERVAL)
+                fd = self._try_slots()
+        except UnsafeDirectoryError as e:
+            if self.log is not None:
+                self.log.warning('Not limiting transfers: %s' % e)
+            self._usable = False
+            yield
+            return
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _open_bucket(self):
+        """Return the bucket file descriptor, None if it cannot be used"""
+        if self._bucket_fd is None and self._ensure_directory():
+            try:
+                self._bucket_fd = _open_shared(
+                    os.path.join(self.directory, 'bucket'))
+            except (OSError, UnsafeDirectoryError) as e:
+                if self.log is not None:
+                    self.log.warning('Not limiting the transfer rate: %s'
+                                     % e)
+                self._usable = False
+        return self._bucket_fd
+
+    def _read_state(self, data):
+        """Validate the bucket state, which any user may have written"""
+        now = self.clock()
+        if len(data) != _BUCKET.size:
+            return [self.burst, now, 0.0]
+        tokens, last, interactive_until = _BUCKET.unpack(data)
+        return [_clamp(tokens, -self.burst, self.burst, self.burst),
+                # In the future after a clock change
+                _clamp(last, float('-inf'), now, now),
+                _clamp(interactive_until, float('-inf'),
+                       now + INTERACTIVE_HOLD, 0.0)]
+
+    @contextlib.contextmanager
+    def _bucket(self):
+        """Lock the token bucket and yield its mutable state"""
+        fd = self._bucket_fd
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            state = self._read_state(os.read(fd, _BUCKET.size))
+            yield state
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, _BUCKET.pack(*state))
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @property
+    def burst(self):
+        return self.rate * BURST_SECONDS
+
+    def consume(self, nbytes):
+        """Account for transferred bytes, sleeping to honour the rate"""
+        if not self.rate or nbytes <= 0 or self._open_bucket() is None:
+            return
+        while True:
+            with self._bucket() as state:
+                tokens, last, interactive_until = state
+                now = self.clock()
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                paused = (self.priority == BACKGROUND and
+                          interactive_until > now)
+                cost = nbytes
+                if paused:
+                    if self._paused_since is None:
+                        self._paused_since = now
+                    if now - self._paused_since >= MAX_BACKGROUND_PAUSE:
+                        # Do not starve forever, go on slowly
+                        paused = False
+                        cost = nbytes / BACKGROUND_SHARE
+                else:
+                    self._paused_since = None
+                if not paused:
+                    if self.priority == INTERACTIVE:
+                        interactive_until = now + INTERACTIVE_HOLD
+                    # Going into debt lets big chunks through, the deficit
+                    # is paid by sleeping
+                    tokens -= cost
+                # A single process may not owe more than one burst
+                state[:] = [max(tokens, -self.burst), now, interactive_until]
+            if paused:
+                self.sleep(POLL_INTERVAL)
+                continue
+            if tokens < 0:
+                self.sleep(min(-tokens / self.rate, MAX_SLEEP))
+            return
+
+    def close(self):
+        if self._bucket_fd is not None:
+            os.close(self._bucket_fd)
+            self._bucket_fd = None
+
+
+def from_config(config, section, log=None):
+    """Create the governor configured in rfpkg.conf, None if disabled
+
+    The priority can be overridden with the RFPKG_TRANSFER_PRIORITY
+    environment variable, so that prefetch jobs can run as background.
+    """
+    def get(option, default=None):
+        if config.has_option(section, option):
+            return config.get(section, option)
+        return default
+
+    try:
+        rate = parse_rate(get('transfer_rate_limit', '0'))
+        max_transfers = int(get('transfer_max_concurrent', '0'))
+        if not rate and not max_transfers:
+            return None
+        priority = os.environ.get('RFPKG_TRANSFER_PRIORITY') or \
+            get('transfer_priority', INTERACTIVE)
+        return TransferGovernor(
+            directory=get('transfer_governor_dir'), rate=rate,
+            max_transfers=max_transfers,
+            reserved_slots=int(get('transfer_reserved_slots',
+                                   str(DEFAULT_RESERVED_SLOTS))),
+            priority=priority, log=log)
+    except ValueError as e:
+        # Loaded by every command, most of which never transfer anything
+        if log is not None:
+            log.warning('Not limiting transfers, invalid transfer '
+                        'configuration: %s' % e)
+        return None
@@ -10,21 +10,31 @@
 """Interact with the RPM Fusion lookaside cache
 
 We need to override the pyrpkg.lookasidecache module to handle our custom
-download path.
+download path, to let the transfer governor throttle transfers and to
+record their metrics.
 """
 
 
+import contextlib
 import os
+import time
+
 from pyrpkg.lookaside import CGILookasideCache
+from six.moves.urllib_parse import urlparse
+
+from .metrics import recorder
 
 
 class RPMFusionLookasideCache(CGILookasideCache):
     def __init__(self, hashtype, download_url, upload_url,
-                 client_cert, ca_cert, namespace):
+                 client_cert, ca_cert, namespace, governor=None):
         super(RPMFusionLookasideCache, self).__init__(
             hashtype, download_url, upload_url, client_cert=client_cert,
             ca_cert=ca_cert)
 
+        self.governor = governor
+        self._transferred = 0
+
         self.download_path_md5 = (
             namespace + '/%(name)s/%(filename)s/%(hash)s/%(filename)s')
         self.download_path = (
@@ -40,3 +50,61 @@ class RPMFusionLookasideCache(CGILookasideCache):
             path = self.download_path % path_dict
         return os.path.join(self.download_url, path)
 
+    @contextlib.contextmanager
+    def _governed(self, kind, url):
+        """Hold a host-wide transfer slot for the duration of a transfer
+
+        The duration and size of the transfer are recorded per lookaside
+        host, without the time spent waiting for the slot.
+        """
+        slot = self.governor.slot() if self.governor is not None \
+            else _no_slot()
+        with slot:
+            self._transferred = 0
+            with recorder.measure(kind, urlparse(url).hostname or url) as m:
+                yield
+                m['bytes'] = int(self._transferred)
+
+    def download(self, name, filename, hash, outfile, hashtype=None,
+                 **kwargs):
+        # Do not wait for a transfer slot when there is nothing to transfer
+        if os.path.exists(outfile) and \
+           self.file_is_valid(outfile, hash, hashtype=hashtype):
+            return
+        with self._governed('download', self.download_url):
+            return super(RPMFusionLookasideCache, self).download(
+                name, filename, hash, outfile, hashtype=hashtype, **kwargs)
+
+    def upload(self, *args, **kwargs):
+        with self._governed('upload', self.upload_url):
+            return super(RPMFusionLookasideCache, self).upload(
+                *args, **kwargs)
+
+    def print_progress(self, to_download, downloaded, to_upload, uploaded):
+        """Report progress, and throttle the transfer from curl callback
+
+        Sleeping here stops curl from reading the socket, which slows the
+        transfer itself down.
+        """
+        super(RPMFusionLookasideCache, self).print_progress(
+            to_download, downloaded, to_upload, uploaded)
+        transferred = downloaded + uploaded
+        delta = int(transferred - self._transferred)
+        if delta > 0:
+            self._transferred = transferred
+            if self.governor is not None:
+                self.governor.consume(delta)
+
+    def hash_file(self, filename, hashtype=None):
+        start = time.time()
+        result = super(RPMFusionLookasideCache, self).hash_file(
+            filename, hashtype=hashtype)
+        recorder.record('hash', hashtype or self.hashtype,
+                        time.time() - start,
+                        nbytes=os.path.getsize(filename), when=start)
+        return result
+
+
+@contextlib.contextmanager
+def _no_slot():
+    yield
@@ -0,0 +1,358 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Record how long rfpkg operations take
+
+Measurements are collected in memory by the module level ``recorder`` while
+a command runs, and appended to a SQLite database in one transaction when
+it finishes.  Each measurement has a kind and a name:
+
+    command   the rfpkg command, e.g. sources or build
+    download  lookaside host the file was downloaded from
+    upload    lookaside host the file was uploaded to
+    hash      hash type used to check a source file
+    koji      Koji call, e.g. getBuildTarget
+
+The store computes percentiles and trends for ``rfpkg stats`` and can be
+exported in the Prometheus textfile format.  Measurements older than the
+retention are pruned, so the counters exported to Prometheus come from a
+separate table of running totals which is never pruned and only grows.
+"""
+
+
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from six.moves.urllib.request import pathname2url
+
+DEFAULT_RETENTION_DAYS = 90
+DAY = 24 * 3600
+QUANTILES = (0.5, 0.9, 0.99)
+
+# The totals are backfilled from the measurements when they are empty, which
+# only happens with databases created before they existed
+SCHEMA = '''
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    command TEXT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    bytes INTEGER,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_time ON measurements (time);
+CREATE TABLE IF NOT EXISTS totals (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    bytes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+INSERT INTO totals (kind, name, count, duration, bytes, failures)
+SELECT kind, name, COUNT(*), SUM(duration), SUM(COALESCE(bytes, 0)),
+       SUM(1 - success)
+FROM measurements WHERE NOT EXISTS (SELECT 1 FROM totals)
+GROUP BY kind, name;
+COMMIT;
+'''
+
+
+def default_db_path():
+    base = os.environ.get('XDG_DATA_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'rfpkg', 'metrics.db')
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile of sorted values"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.retention_days = DEFAULT_RETENTION_DAYS
+        self.command = None
+        self.measurements = []
+
+    def configure(self, config, section):
+        """Enable recording if the metrics option is set in rfpkg.conf"""
+        if config.has_option(section, 'metrics'):
+            self.enabled = config.getboolean(section, 'metrics')
+        if config.has_option(section, 'metrics_db'):
+            self.path = os.path.expanduser(config.get(section, 'metrics_db'))
+        if config.has_option(section, 'metrics_retention_days'):
+            self.retention_days = config.getint(section,
+                                                'metrics_retention_days')
+
+    def record(self, kind, name, duration, nbytes=None, success=True,
+               when=None):
+        if not self.enabled:
+            return
+        self.measurements.append(
+            (when or time.time(), kind, name, duration, nbytes, success))
+
+    @contextlib.contextmanager
+    def measure(self, kind, name):
+        """Record the duration of a block, failed if it raises
+
+        Yields a dict where the block can store the transferred bytes.
+        """
+        data = {'bytes': None}
+        start = time.time()
+        success = False
+        try:
+            yield data
+            success = True
+        finally:
+            self.record(kind, name, time.time() - start,
+                        nbytes=data['bytes'], success=success, when=start)
+
+    def flush(self):
+        if not self.measurements:
+            return
+        store = MetricsStore(self.path)
+        try:
+            store.append(self.measurements, command=self.command)
+            store.prune(time.time() - self.retention_days * DAY)
+        finally:
+            store.close()
+        del self.measurements[:]
+
+
+recorder = Recorder()
+
+
+class MetricsStore(object):
+    """The metrics database
+
+    A read only store neither creates the database, which must exist, nor
+    locks it for writing.
+    """
+
+    def __init__(self, path=None, readonly=False):
+        self.path = path or default_db_path()
+        if readonly:
+            self.db = sqlite3.connect(
+                'file:%s?mode=ro' % pathname2url(os.path.abspath(self.path)),
+                uri=True, timeout=30)
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Several rfpkg processes may write at the same time
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def append(self, measurements, command=None):
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO measurements (time, command, kind, name, '
+                'duration, bytes, success) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(when, command, kind, name, duration, nbytes, int(success))
+                 for when, kind, name, duration, nbytes, success
+                 in measurements])
+            for when, kind, name, duration, nbytes, success in measurements:
+                self.db.execute(
+                    'INSERT OR IGNORE INTO totals (kind, name, count, '
+                    'duration, bytes, failures) VALUES (?, ?, 0, 0, 0, 0)',
+                    (kind, name))
+                self.db.execute(
+                    'UPDATE totals SET count = count + 1, '
+                    'duration = duration + ?, bytes = bytes + ?, '
+                    'failures = failures + ? WHERE kind = ? AND name = ?',
+                    (duration, nbytes or 0, int(not success), kind, name))
+
+    def prune(self, before):
+        with self.db:
+            self.db.execute('DELETE FROM measurements WHERE time < ?',
+                            (before,))
+
+    def totals(self, kind=None):
+        """Running totals per kind and name, never pruned"""
+        has_totals = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'totals'").fetchone()
+        if has_totals:
+            query = ('SELECT kind, name, count, duration, bytes, failures '
+                     'FROM totals WHERE 1')
+            group = ''
+        else:
+            # Opened read only before being upgraded, compute what the
+            # totals will be backfilled with
+            query = ('SELECT kind, name, COUNT(*), SUM(duration), '
+                     'SUM(COALESCE(bytes, 0)), SUM(1 - success) '
+                     'FROM measurements WHERE 1')
+            group = ' GROUP BY kind, name'
+        params = []
+        if kind is not None:
+            query += ' AND kind = ?'
+            params.append(kind)
+        query += group + ' ORDER BY kind, name'
+        return [dict(zip(('kind', 'name', 'count', 'duration', 'bytes',
+                          'failures'), row))
+                for row in self.db.execute(query, params)]
+
+    def _rows(self, since=None, until=None, kind=None):
+        query = ('SELECT kind, name, duration, bytes, success '
+                 'FROM measurements WHERE 1')
+        params = []
+        if since is not None:
+            query += ' AND time >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND time < ?'
+            params.append(until)
+        if kind is not None:
+            query += ' AND kind = ?'
+            params.append(kind)
+        return self.db.execute(query, params)
+
+    def summary(self, since=None, until=None, kind=None):
+        """Statistics per kind and name, sorted by kind and name"""
+        groups = {}
+        for kind_, name, duration, nbytes, success in \
+                self._rows(since, until, kind):
+            group = groups.setdefault((kind_, name), {
+                'durations': [], 'bytes': 0, 'bytes_duration': 0.0,
+                'failures': 0})
+            group['durations'].append(duration)
+            if nbytes:
+                group['bytes'] += nbytes
+                group['bytes_duration'] += duration
+            if not success:
+                group['failures'] += 1
+
+        results = []
+        for (kind_, name), group in sorted(groups.items()):
+            durations = sorted(group['durations'])
+            result = {
+                'kind': kind_,
+                'name': name,
+                'count': len(durations),
+                'sum': sum(durations),
+                'failures': group['failures'],
+                'bytes': group['bytes'],
+                # Bytes per second over the measurements which moved data
+                'throughput': (group['bytes'] / group['bytes_duration']
+                               if group['bytes_duration'] else None),
+                'quantiles': dict((q, percentile(durations, q))
+                                  for q in QUANTILES),
+            }
+            results.append(result)
+        return results
+
+    def trends(self, window, now=None, kind=None):
+        """Relative change of the median duration between two windows
+
+        Compares the last window seconds with the window before, returns a
+        dict mapping (kind, name) to the change, e.g. 0.1 for 10% slower.
+        """
+        now = now or time.time()
+        current = self.summary(since=now - window, until=now, kind=kind)
+        previous = dict(((s['kind'], s['name']), s) for s in self.summary(
+            since=now - 2 * window, until=now - window, kind=kind))
+        trends = {}
+        for stats in current:
+            key = (stats['kind'], stats['name'])
+            if key not in previous:
+                continue
+            before = previous[key]['quantiles'][0.5]
+            if before:
+                trends[key] = stats['quantiles'][0.5] / before - 1
+        return trends
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(stats):
+    return 'kind="%s",name="%s"' % (_escape_label(stats['kind']),
+                                    _escape_label(stats['name']))
+
+
+def format_prometheus(totals, summaries, window):
+    """Render metrics in the Prometheus text exposition format
+
+    Counters come from the running totals.  Quantiles and throughput can
+    only be computed over the measurements still stored, they are exported
+    as gauges over the last window seconds.
+    """
+    lines = []
+    for metric, key, help_text in (
+            ('rfpkg_operations_total', 'count', 'rfpkg operations.'),
+            ('rfpkg_operation_failures_total', 'failures',
+             'Failed rfpkg operations.'),
+            ('rfpkg_operation_duration_seconds_total', 'duration',
+             'Time spent in rfpkg operations.'),
+            ('rfpkg_operation_bytes_total', 'bytes',
+             'Bytes moved by rfpkg operations.')):
+        lines.extend(['# HELP %s %s' % (metric, help_text),
+                      '# TYPE %s counter' % metric])
+        for stats in totals:
+            lines.append('%s{%s} %r' % (metric, _labels(stats), stats[key]))
+
+    lines.extend([
+        '# HELP rfpkg_metrics_window_seconds Length of the window of the '
+        '_window metrics.',
+        '# TYPE rfpkg_metrics_window_seconds gauge',
+        'rfpkg_metrics_window_seconds %r' % float(window),
+        '# HELP rfpkg_operation_duration_seconds_window Duration quantiles '
+        'of rfpkg operations over the window.',
+        '# TYPE rfpkg_operation_duration_seconds_window gauge',
+    ])
+    for stats in summaries:
+        for q in QUANTILES:
+            lines.append('rfpkg_operation_duration_seconds_window'
+                         '{%s,quantile="%s"} %r'
+                         % (_labels(stats), q, stats['quantiles'][q]))
+
+    lines.extend([
+        '# HELP rfpkg_transfer_bytes_per_second_window Average throughput '
+        'of rfpkg operations moving data over the window.',
+        '# TYPE rfpkg_transfer_bytes_per_second_window gauge',
+    ])
+    for stats in summaries:
+        if stats['throughput'] is not None:
+            lines.append('rfpkg_transfer_bytes_per_second_window{%s} %r'
+                         % (_labels(stats), stats['throughput']))
+    return '\n'.join(lines) + '\n'
+
+
+def export_prometheus(totals, summaries, window, path):
+    """Atomically write a textfile for the node_exporter textfile collector"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.rfpkg-', suffix='.prom')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(format_prometheus(totals, summaries, window))
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,294 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Local cache of the RPM Fusion pkgdb package metadata
+
+Namespaces, branches, retired status and ACLs of packages are kept in a
+JSON file.  Entries expire after a TTL and are refreshed with conditional
+requests, so unchanged data is not transferred again.  Whole namespaces can
+be synced with the paginated package listing of the pkgdb API.
+"""
+
+
+import errno
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+PKGDB_URL = 'https://admin.rpmfusion.org/pkgdb'
+DEFAULT_TTL = 3600
+NAMESPACES = ('free', 'nonfree')
+CACHE_VERSION = 1
+PAGE_LIMIT = 500
+# Seconds to connect, and to wait for data once connected
+REQUEST_TIMEOUT = (10, 60)
+RETIRED = 'Retired'
+
+
+def default_cache_path():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'rfpkg', 'pkgdb.json')
+
+
+def _parse_acls(acls):
+    return [{'user': acl.get('fas_name'), 'acl': acl.get('acl'),
+             'status': acl.get('status')} for acl in acls or []]
+
+
+def make_entry(package, listings, fetched):
+    """Build a cache entry from a pkgdb package and its package listings"""
+    branches = {}
+    for listing in listings:
+        branch = listing.get('collection', {}).get('branchname')
+        if not branch:
+            continue
+        branches[branch] = {
+            'status': listing.get('status'),
+            'point_of_contact': listing.get('point_of_contact'),
+            'acls': _parse_acls(listing.get('acls')),
+        }
+    return {
+        'namespace': package.get('namespace'),
+        'name': package['name'],
+        'status': package.get('status'),
+        'branches': branches,
+        'fetched': fetched,
+    }
+
+
+def is_retired(entry, branch):
+    return entry['branches'].get(branch, {}).get('status') == RETIRED
+
+
+class PkgDBCacheError(Exception):
+    pass
+
+
+class PkgDBCache(object):
+    def __init__(self, path=None, url=PKGDB_URL, ttl=DEFAULT_TTL,
+                 session=None, timeout=REQUEST_TIMEOUT):
+        self.path = path or default_cache_path()
+        self.url = url.rstrip('/')
+        self.ttl = ttl
+        self.timeout = timeout
+        self._session = session
+        self._data = None
+        # Number of HTTP requests sent and how many were answered with 304
+        self.requests = 0
+        self.not_modified = 0
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            data = None
+        if not data or data.get('version') != CACHE_VERSION:
+            data = {'version': CACHE_VERSION, 'validators': {},
+                    'namespaces': {}, 'packages': {}}
+        return data
+
+    def save(self):
+        """Atomically write the cache, readers never see a partial file"""
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.pkgdb-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f)
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def _is_fresh(self, fetched):
+        return fetched is not None and time.time() - fetched < self.ttl
+
+    @staticmethod
+    def _key(namespace, name):
+        return '%s/%s' % (namespace, name)
+
+    def get(self, namespace, name):
+        """Return the cached entry of a package if it did not expire yet
+
+        This never touches the network.
+        """
+        entry = self.data['packages'].get(self._key(namespace, name))
+        if entry is not None and self._is_fresh(entry['fetched']):
+            return entry
+        return None
+
+    def entries(self, namespace=None):
+        for key in sorted(self.data['packages']):
+            entry = self.data['packages'][key]
+            if namespace is None or entry['namespace'] == namespace:
+                yield entry
+
+    def is_synced(self, namespace):
+        """Whether a namespace was synced less than TTL seconds ago"""
+        state = self.data['namespaces'].get(namespace, {})
+        return self._is_fresh(state.get('synced'))
+
+    def _request(self, path, params):
+        """GET an API endpoint
+
+        Returns the cache key of the request and the decoded JSON, which is
+        None when the server answered that the data did not change.
+        """
+        url = '%s/api/%s' % (self.url, path)
+        key = '%s?%s' % (url, '&'.join(
+            '%s=%s' % item for item in sorted(params.items())))
+        validator = self.data['validators'].get(key, {})
+        headers = {}
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+
+        self.requests += 1
+        try:
+            response = self.session.get(url, params=params, headers=headers,
+                                        timeout=self.timeout)
+        except requests.RequestException as e:
+            # Including requests.Timeout, when pkgdb stalls
+            raise PkgDBCacheError('Request to %s failed: %s' % (url, e))
+        if response.status_code == 304:
+            self.not_modified += 1
+            return key, None
+        if response.status_code == 404:
+            return key, {}
+        if not response.ok:
+            raise PkgDBCacheError('Request to %s failed with status %d'
+                                  % (response.url, response.status_code))
+        self.data['validators'][key] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        try:
+            return key, response.json()
+        except ValueError:
+            raise PkgDBCacheError('Invalid JSON returned by %s'
+                                  % response.url)
+
+    def refresh(self, namespace, name, force=False):
+        """Return the entry of a package, fetching it when it expired
+
+        Returns None if the package does not exist in pkgdb.
+        """
+        if not force:
+            entry = self.get(namespace, name)
+            if entry is not None:
+                return entry
+
+        key = self._key(namespace, name)
+        request_key, data = self._request('package/', {
+            'pkgname': name, 'namespace': namespace, 'acls': True})
+        now = time.time()
+        if data is None:
+            entry = self.data['packages'].get(key)
+            if entry is not None:
+                entry['fetched'] = now
+                return entry
+            # Validator without an entry, drop it and fetch for real
+            self.data['validators'].pop(request_key, None)
+            return self.refresh(namespace, name, force=True)
+
+        listings = data.get('packages') or []
+        if not listings:
+            self.data['packages'].pop(key, None)
+            return None
+        package = dict(listings[0]['package'])
+        package.setdefault('namespace', namespace)
+        entry = make_entry(package, listings, now)
+        self.data['packages'][key] = entry
+        return entry
+
+    def sync(self, namespace, force=False):
+        """Refresh every package of a namespace, page by page
+
+        Returns the number of packages in the namespace, or None when the
+        namespace was synced less than TTL seconds ago.
+        """
+        if not force and self.is_synced(namespace):
+            return None
+        state = self.data['namespaces'].setdefault(namespace, {'pages': {}})
+
+        now = time.time()
+        seen = set()
+        pages = {}
+        page = 1
+        page_total = 1
+        while page <= page_total:
+            key, data = self._request('packages/', {
+                'pattern': '*', 'namespace': namespace, 'acls': True,
+                'page': page, 'limit': PAGE_LIMIT})
+            previous = state['pages'].get(key)
+            if data is None and previous is not None:
+                names = previous['names']
+                page_total = previous['page_total']
+                for name in names:
+                    entry = self.data['packages'].get(
+                        self._key(namespace, name))
+                    if entry is not None:
+                        entry['fetched'] = now
+            else:
+                if data is None:
+                    # Unknown page answered with 304, fetch it for real
+                    self.data['validators'].pop(key, None)
+                    continue
+                names = []
+                for package in data.get('packages') or []:
+                    package = dict(package)
+                    package.setdefault('namespace', namespace)
+                    entry = make_entry(package, package.get('acls') or [],
+                                       now)
+                    self.data['packages'][
+                        self._key(namespace, entry['name'])] = entry
+                    names.append(entry['name'])
+                page_total = data.get('page_total') or 1
+            pages[key] = {'names': names, 'page_total': page_total}
+            seen.update(names)
+            page += 1
+
+        # Forget the packages which disappeared from pkgdb
+        for entry in list(self.entries(namespace)):
+            if entry['name'] not in seen:
+                del self.data['packages'][self._key(namespace, entry['name'])]
+
+        state['pages'] = pages
+        state['synced'] = now
+        return len(seen)
+
+    def mark_retired(self, namespace, name, branch):
+        """Record a retirement done by rfpkg in an already cached entry"""
+        entry = self.data['packages'].get(self._key(namespace, name))
+        if entry is not None and branch in entry['branches']:
+            entry['branches'][branch]['status'] = RETIRED
+            return True
+        return False
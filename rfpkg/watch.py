@@ -0,0 +1,219 @@
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Watch many Koji tasks over a single session
+
+Instead of one loop per task polling the hub at a fixed interval, all the
+tasks and their children are polled together: the tasks due for a poll are
+queried with one multicall.  A task whose state did not change is polled less
+and less often, up to a maximum interval, and goes back to the initial
+interval as soon as it changes.  Every state transition is reported as an
+event, a plain dict that can be dumped as JSON.
+"""
+
+
+import asyncio
+import json
+import sys
+import time
+
+import koji
+
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 60
+DEFAULT_BACKOFF = 1.5
+FINISHED_STATES = ('CLOSED', 'CANCELED', 'FAILED')
+
+
+class UnknownTaskError(Exception):
+    pass
+
+
+def task_label(info):
+    try:
+        return koji.taskLabel(info)
+    except Exception:
+        return info.get('method', '')
+
+
+class WatchedTask(object):
+    def __init__(self, task_id, parent, interval, next_poll):
+        self.task_id = task_id
+        self.parent = parent
+        self.info = None
+        self.label = None
+        self.state = None
+        self.interval = interval
+        self.next_poll = next_poll
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+
+class TaskWatcher(object):
+    """Poll Koji tasks and their children until they are all finished
+
+    session is anything providing the getTaskInfo, getTaskChildren and
+    multicall methods of koji.ClientSession. on_event is called with every
+    state transition.
+    """
+
+    def __init__(self, session, task_ids, on_event=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF,
+                 clock=time.time):
+        self.session = session
+        self.root_ids = list(task_ids)
+        self.on_event = on_event
+        self.poll_interval = poll_interval
+        self.max_interval = max(max_interval, poll_interval)
+        self.backoff = backoff
+        self.clock = clock
+        self.tasks = {}
+        # Number of multicalls sent to the hub
+        self.requests = 0
+
+    def _add(self, task_id, parent, now):
+        if task_id not in self.tasks:
+            self.tasks[task_id] = WatchedTask(task_id, parent,
+                                              self.poll_interval, now)
+
+    @property
+    def done(self):
+        return all(task.finished for task in self.tasks.values())
+
+    def _fetch(self, tasks):
+        """Query info and children of the given tasks in one multicall
+
+        The request of a task, only needed for its label, is fetched the
+        first time only.
+        """
+        with self.session.multicall(strict=True) as m:
+            calls = [(m.getTaskInfo(task.task_id,
+                                    request=task.info is None),
+                      m.getTaskChildren(task.task_id))
+                     for task in tasks]
+        self.requests += 1
+        return [(info.result, children.result) for info, children in calls]
+
+    def _update(self, task, info, children, now):
+        if info is None:
+            # getTaskInfo returns None for tasks the hub does not know
+            raise UnknownTaskError('Task %d does not exist' % task.task_id)
+        state = koji.TASK_STATES[info['state']]
+        if task.label is None:
+            task.label = task_label(info)
+        for child in children:
+            self._add(child['id'], task.task_id, now)
+        if state != task.state:
+            event = {
+                'time': now,
+                'task_id': task.task_id,
+                'parent': task.parent,
+                'method': info.get('method'),
+                'arch': info.get('arch'),
+                'label': task.label,
+                'state': state,
+                'previous_state': task.state,
+            }
+            task.info = info
+            task.state = state
+            task.interval = self.poll_interval
+            if self.on_event is not None:
+                self.on_event(event)
+        else:
+            task.interval = min(task.interval * self.backoff,
+                                self.max_interval)
+        task.next_poll = now + task.interval
+
+    async def poll(self):
+        """Poll the tasks which are due, return when the next poll is due"""
+        loop = asyncio.get_event_loop()
+        now = self.clock()
+        due = [task for task in self.tasks.values()
+               if not task.finished and task.next_poll <= now]
+        if due:
+            # koji is synchronous, keep the event loop free while waiting
+            results = await loop.run_in_executor(
+                None, self._fetch, due)
+            now = self.clock()
+            for task, (info, children) in zip(due, results):
+                self._update(task, info, children, now)
+        pending = [task.next_poll for task in self.tasks.values()
+                   if not task.finished]
+        return min(pending) if pending else now
+
+    async def watch(self):
+        """Watch until every task is finished, return the root task states"""
+        now = self.clock()
+        for task_id in self.root_ids:
+            self._add(task_id, None, now)
+        while not self.done:
+            next_poll = await self.poll()
+            if not self.done:
+                await asyncio.sleep(max(0, next_poll - self.clock()))
+        return dict((task_id, self.tasks[task_id].state)
+                    for task_id in self.root_ids)
+
+
+def json_printer(stream=sys.stdout):
+    """Event callback writing one JSON object per line"""
+    def on_event(event):
+        stream.write(json.dumps(event, sort_keys=True) + '\n')
+        stream.flush()
+    return on_event
+
+
+def text_printer(log):
+    """Event callback logging transitions like the koji watch loop does"""
+    def on_event(event):
+        indent = '  ' if event['parent'] else ''
+        if event['previous_state'] is None:
+            log.info('%s%d %s: %s' % (indent, event['task_id'],
+                                       event['label'], event['state'].lower()))
+        else:
+            log.info('%s%d %s: %s -> %s'
+                     % (indent, event['task_id'], event['label'],
+                        event['previous_state'].lower(),
+                        event['state'].lower()))
+    return on_event
+
+
+def display_task_results(watcher, log):
+    """Log the outcome of the root tasks, like pyrpkg does after a build"""
+    for task_id in watcher.root_ids:
+        task = watcher.tasks[task_id]
+        label = '%d %s' % (task_id, task.label)
+        if task.state == 'CLOSED':
+            log.info('%s completed successfully' % label)
+        elif task.state == 'FAILED':
+            log.info('%s failed' % label)
+        elif task.state == 'CANCELED':
+            log.info('%s was canceled' % label)
+        else:
+            log.info('%s has not completed' % label)
+
+
+def watch_tasks(session, task_ids, results_log=None, **kwargs):
+    """Synchronously watch tasks, return 0 if all of them succeeded
+
+    The outcome of every task is logged to results_log when given.
+    """
+    watcher = TaskWatcher(session, task_ids, **kwargs)
+    loop = asyncio.new_event_loop()
+    try:
+        states = loop.run_until_complete(watcher.watch())
+    finally:
+        loop.close()
+    if results_log is not None:
+        display_task_results(watcher, results_log)
+    if all(state == 'CLOSED' for state in states.values()):
+        return 0
+    return 1
@@ -0,0 +1,205 @@
+# rfpkg_client - thin client for the rfpkg daemon
+#
+# Copyright (C) 2026 - RPM Fusion
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+"""Forward a rfpkg command line to a running ``rfpkg serve`` daemon
+
+This module lives outside of the rfpkg package on purpose: importing rfpkg
+pulls in pyrpkg, koji and git, which is exactly the start up cost the daemon
+is meant to avoid.  Only the standard library may be imported here.
+
+The client sends its argv, working directory, environment and umask as one
+JSON line, together with its stdin, stdout and stderr file descriptors.  The
+daemon runs the command on those descriptors directly, so output is never
+copied through the socket, and answers with the pid of the worker and later
+its exit status.  Signals received by the client are forwarded to the
+process group of the worker.  When no daemon is listening the regular rfpkg
+is executed instead.
+
+Workers run in a session of their own, without a controlling terminal, so
+nothing they start can open /dev/tty.  Commands which talk to the git server
+over ssh, and may have to ask for a key passphrase or confirm a host key,
+are always run by the regular rfpkg.
+"""
+
+import array
+import errno
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+
+SOCKET_NAME = 'rfpkg.sock'
+FALLBACK_PROGRAM = 'rfpkg'
+# stdin, stdout and stderr
+MAX_FDS = 3
+RECV_SIZE = 65536
+FORWARDED_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT')
+# Commands which may need /dev/tty, see needs_terminal()
+TERMINAL_COMMANDS = ('clone', 'co', 'pull', 'push', 'retire')
+
+
+def runtime_dir():
+    """Per-user directory holding the daemon socket"""
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        return os.path.join(base, 'rfpkg')
+    return os.path.join('/tmp', 'rfpkg-%d' % os.getuid())
+
+
+def socket_path():
+    return os.environ.get('RFPKG_SOCKET') or \
+        os.path.join(runtime_dir(), SOCKET_NAME)
+
+
+def is_private_dir(path):
+    """Check that path is a directory only accessible by the current user"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+            not st.st_mode & 0o077)
+
+
+def ensure_runtime_dir(path):
+    """Create the socket directory, refusing to use one shared with others"""
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if not is_private_dir(path):
+        raise OSError(errno.EPERM,
+                      '%s must be a directory owned by uid %d and not '
+                      'accessible by other users' % (path, os.getuid()))
+
+
+def send_message(sock, message, fds=None):
+    """Send one JSON message, optionally passing file descriptors along"""
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    if fds:
+        sent = sock.sendmsg(
+            [data],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+
+
+class MessageReader(object):
+    """Read JSON lines and the file descriptors passed with them"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+        self.fds = []
+
+    def read(self):
+        """Return the next message, or None when the peer went away"""
+        while b'\n' not in self.buffer:
+            itemsize = array.array('i').itemsize
+            data, ancdata, _, _ = self.sock.recvmsg(
+                RECV_SIZE, socket.CMSG_SPACE(MAX_FDS * itemsize))
+            for level, kind, cdata in ancdata:
+                if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                    fds = array.array('i')
+                    fds.frombytes(cdata[:len(cdata) - len(cdata) % itemsize])
+                    self.fds.extend(fds)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line.decode('utf-8'))
+
+
+def connect(path=None):
+    """Connect to the daemon of the current user, None if there is none"""
+    path = path or socket_path()
+    if not is_private_dir(os.path.dirname(path)):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (OSError, socket.error):
+        sock.close()
+        return None
+    return sock
+
+
+def needs_terminal(argv):
+    """Whether the command line may run something prompting on /dev/tty
+
+    Options are not parsed: an option value looking like one of these
+    commands only costs running the regular rfpkg.
+    """
+    if any(arg in TERMINAL_COMMANDS for arg in argv):
+        return True
+    # commit --push
+    return 'commit' in argv and ('-p' in argv or '--push' in argv)
+
+
+def fallback(argv):
+    """Run the regular rfpkg in place of this process"""
+    program = os.environ.get('RFPKG_PROGRAM', FALLBACK_PROGRAM)
+    os.execvp(program, [program] + argv)
+
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        cwd = os.getcwd()
+    except OSError:
+        print('Could not get current path, have you deleted it?')
+        sys.exit(1)
+
+    if needs_terminal(argv):
+        fallback(argv)
+    sock = connect()
+    if sock is None:
+        fallback(argv)
+
+    umask = os.umask(0)
+    os.umask(umask)
+    request = {'argv': argv, 'cwd': cwd, 'env': dict(os.environ),
+               'umask': umask}
+    try:
+        send_message(sock, request, fds=[0, 1, 2])
+    except (OSError, socket.error):
+        # The daemon went away between connect and send, e.g. idle shutdown
+        sock.close()
+        fallback(argv)
+
+    reader = MessageReader(sock)
+    while True:
+        message = reader.read()
+        if message is None:
+            sys.stderr.write('rfpkg daemon closed the connection\n')
+            sys.exit(1)
+        if 'pid' in message:
+            pid = message['pid']
+
+            def forward(signum, frame):
+                # The worker leads its own process group, which includes
+                # every process started by the command
+                try:
+                    os.killpg(pid, signum)
+                except OSError:
+                    pass
+
+            for name in FORWARDED_SIGNALS:
+                signal.signal(getattr(signal, name), forward)
+        if 'status' in message:
+            sys.exit(message['status'])
+
+
+if __name__ == '__main__':
+    main()
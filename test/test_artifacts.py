@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from rfpkg.artifacts import Artifact, ArtifactError, Downloader, \
+    resolve_task, select, verify
+
+
+def _response(status_code, content=b''):
+    response = mock.Mock(status_code=status_code)
+    response.iter_content.return_value = [content]
+    return response
+
+
+class FakeCall(object):
+    def __init__(self, result):
+        self.result = result
+
+
+class FakeSession(object):
+    """Koji session knowing a task and its descendents"""
+
+    def __init__(self, tasks, children, outputs):
+        self.tasks = tasks
+        self.children = children
+        self.outputs = outputs
+
+    def getTaskInfo(self, task_id, strict=False):
+        return self.tasks[task_id]
+
+    def getTaskDescendents(self, task_id):
+        return dict((str(parent), [self.tasks[child] for child in children])
+                    for parent, children in self.children.items())
+
+    def listTaskOutput(self, task_id, stat=False):
+        return self.outputs.get(task_id, {})
+
+    @contextlib.contextmanager
+    def multicall(self, strict=False):
+        session = self
+
+        class Calls(object):
+            def listTaskOutput(self, *args, **kwargs):
+                return FakeCall(session.listTaskOutput(*args, **kwargs))
+
+        yield Calls()
+
+
+class ResolveTaskTestCase(unittest.TestCase):
+    def test_same_arch_tasks(self):
+        rpm = 'foo-1.0-1.x86_64.rpm'
+        output = {rpm: {'st_size': '10'}, 'build.log': {'st_size': '5'},
+                  'root.log': {'st_size': '5'}}
+        session = FakeSession(
+            tasks={1: {'id': 1, 'arch': 'noarch'},
+                   2: {'id': 2, 'arch': 'x86_64'},
+                   3: {'id': 3, 'arch': 'x86_64'}},
+            children={1: [3, 2]},
+            outputs={2: output, 3: dict(output)})
+
+        name, artifacts = resolve_task(session, 'https://koji', 1)
+
+        self.assertEqual(name, 'task-1')
+        paths = [a.path for a in artifacts]
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertEqual(sorted(paths), [
+            'logs/x86_64/2/build.log', 'logs/x86_64/2/root.log',
+            'logs/x86_64/3/build.log', 'logs/x86_64/3/root.log',
+            'x86_64/' + rpm])
+        # Taken from the oldest task
+        self.assertTrue([a for a in artifacts if a.kind == 'rpm'][0]
+                        .url.endswith('/2/' + rpm))
+
+
+class SelectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.artifacts = [
+            Artifact('u', 'x86_64/a.rpm', 'rpm', 'x86_64', name='nvidia'),
+            Artifact('u', 'x86_64/b.rpm', 'rpm', 'x86_64', name='nvidia-libs'),
+            Artifact('u', 'i686/b.rpm', 'rpm', 'i686', name='nvidia-libs'),
+            Artifact('u', 'logs/x86_64/build.log', 'log', 'x86_64',
+                     name='build'),
+            Artifact('u', 'logs/x86_64/root.log', 'log', 'x86_64',
+                     name='root'),
+        ]
+
+    def _paths(self, **kwargs):
+        return [a.path for a in select(self.artifacts, **kwargs)]
+
+    def test_no_filter(self):
+        self.assertEqual(len(self._paths()), 5)
+
+    def test_arch_and_subpackage(self):
+        self.assertEqual(
+            self._paths(arches=['x86_64'], subpackages=['nvidia-libs'],
+                        with_logs=False),
+            ['x86_64/b.rpm'])
+
+    def test_log_type(self):
+        self.assertEqual(self._paths(logs=['root'], with_rpms=False),
+                         ['logs/x86_64/root.log'])
+
+
+class DownloaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.downloader = Downloader(self.tmpdir, mock.Mock(), jobs=2)
+        patcher = mock.patch('requests.Session')
+        self.get = patcher.start().return_value.get
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, *parts):
+        return os.path.join(self.tmpdir, *parts)
+
+    def test_download(self):
+        self.get.return_value = _response(200, b'0123456789')
+        artifact = Artifact('https://koji/build.log', 'logs/x86_64/build.log',
+                            'log', 'x86_64', size=10)
+
+        self.assertEqual(self.downloader.download([artifact]), [])
+        with open(self._path('logs', 'x86_64', 'build.log'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+        # Valid files are not downloaded again
+        self.downloader.fetch(artifact)
+        self.assertEqual(self.get.call_count, 1)
+        self.assertIsNotNone(self.get.call_args[1]['timeout'])
+
+    def test_resume(self):
+        os.makedirs(self._path('x86_64'))
+        with open(self._path('x86_64', 'build.log.part'), 'wb') as f:
+            f.write(b'01234')
+        self.get.return_value = _response(206, b'56789')
+        artifact = Artifact('https://koji/build.log', 'x86_64/build.log',
+                            'log', 'x86_64', size=10)
+
+        self.downloader.fetch(artifact)
+        args, kwargs = self.get.call_args
+        self.assertEqual(kwargs['headers'], {'Range': 'bytes=5-'})
+        with open(self._path('x86_64', 'build.log'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_size_mismatch(self):
+        self.get.return_value = _response(200, b'truncated')
+        artifact = Artifact('https://koji/build.log', 'x86_64/build.log',
+                            'log', 'x86_64', size=10)
+
+        self.assertRaises(ArtifactError, self.downloader.fetch, artifact)
+        self.assertFalse(os.path.exists(self._path('x86_64', 'build.log')))
+        self.assertFalse(
+            os.path.exists(self._path('x86_64', 'build.log.part')))
+
+    def test_http_error(self):
+        self.get.return_value = _response(404)
+        artifact = Artifact('https://koji/missing.log', 'x86_64/missing.log',
+                            'log', 'x86_64')
+
+        errors = self.downloader.download([artifact])
+        self.assertEqual(len(errors), 1)
+
+
+class VerifyTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'0123456789')
+        self.addCleanup(os.unlink, self.path)
+
+    def test_sha256(self):
+        sha256 = hashlib.sha256(b'0123456789').hexdigest()
+        verify(Artifact('u', 'build.log', 'log', 'x86_64', size=10,
+                        sha256=sha256), self.path)
+        self.assertRaises(
+            ArtifactError, verify,
+            Artifact('u', 'build.log', 'log', 'x86_64', sha256='0' * 64),
+            self.path)
+
+    @mock.patch('subprocess.Popen')
+    def test_rpm_digests(self, popen):
+        proc = popen.return_value
+        proc.communicate.return_value = (b'DIGESTS NOT OK', None)
+        proc.returncode = 1
+        artifact = Artifact('u', 'x86_64/foo.rpm', 'rpm', 'x86_64')
+
+        self.assertRaises(ArtifactError, verify, artifact, self.path)
+        self.assertEqual(popen.call_args[0][0],
+                         ['rpmkeys', '-K', '--nosignature', self.path])
+
+        proc.returncode = 0
+        verify(artifact, self.path)
+
+    @mock.patch('subprocess.Popen', side_effect=OSError(2, 'No such file'))
+    def test_rpm_digests_without_rpmkeys(self, popen):
+        artifact = Artifact('u', 'x86_64/foo.rpm', 'rpm', 'x86_64')
+        self.assertRaises(ArtifactError, verify, artifact, self.path)
+
+
+class DownloaderFailureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        patcher = mock.patch('requests.Session')
+        self.get = patcher.start().return_value.get
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('subprocess.Popen')
+    @mock.patch('koji.get_rpm_header', create=True)
+    def test_unreadable_header(self, get_rpm_header, popen):
+        get_rpm_header.side_effect = RuntimeError('error reading header')
+        self.get.return_value = _response(200, b'not an rpm')
+        rpm = Artifact('https://koji/foo.rpm', 'x86_64/foo.rpm', 'rpm',
+                       'x86_64', sigmd5='0' * 32)
+        log = Artifact('https://koji/build.log', 'logs/x86_64/build.log',
+                       'log', 'x86_64')
+        downloader = Downloader(self.tmpdir, mock.Mock(), jobs=1)
+
+        errors = downloader.download([rpm, log])
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ArtifactError)
+        # The other files are still downloaded
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmpdir, 'logs', 'x86_64', 'build.log')))
+        # Downloaded again from scratch next time
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, 'x86_64', 'foo.rpm.part')))
+
+    def test_pending_downloads_cancelled(self):
+        def get(url, **kwargs):
+            if url.endswith('/0.log'):
+                raise KeyboardInterrupt()
+            return _response(200, b'x')
+        self.get.side_effect = get
+        artifacts = [Artifact('https://koji/%d.log' % i,
+                              'logs/noarch/%d.log' % i, 'log', 'noarch')
+                     for i in range(10)]
+        downloader = Downloader(self.tmpdir, mock.Mock(), jobs=1)
+
+        self.assertRaises(KeyboardInterrupt, downloader.download, artifacts)
+        # At most the download started while the error was raised
+        self.assertTrue(self.get.call_count <= 2)
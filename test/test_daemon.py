@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import rfpkg_client
+from rfpkg.__main__ import parse_config_args
+from rfpkg.daemon import Server
+
+
+class ClientProtocolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.client_sock, self.server_sock = socket.socketpair()
+
+    def tearDown(self):
+        self.client_sock.close()
+        self.server_sock.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_request_with_fds(self):
+        request = {'argv': ['sources'] * 5000, 'cwd': '/', 'env': {},
+                   'umask': 0o022}
+        rfpkg_client.send_message(self.client_sock, request, fds=[0, 1, 2])
+        rfpkg_client.send_message(self.client_sock, {'status': 0})
+
+        reader = rfpkg_client.MessageReader(self.server_sock)
+        try:
+            self.assertEqual(reader.read(), request)
+            self.assertEqual(len(reader.fds), rfpkg_client.MAX_FDS)
+            self.assertEqual(reader.read(), {'status': 0})
+        finally:
+            for fd in reader.fds:
+                os.close(fd)
+
+    def test_read_after_close(self):
+        self.client_sock.close()
+        reader = rfpkg_client.MessageReader(self.server_sock)
+        self.assertIsNone(reader.read())
+
+    def test_runtime_dir_must_be_private(self):
+        path = os.path.join(self.tmpdir, 'rfpkg')
+        rfpkg_client.ensure_runtime_dir(path)
+        self.assertTrue(rfpkg_client.is_private_dir(path))
+
+        os.chmod(path, 0o755)
+        self.assertFalse(rfpkg_client.is_private_dir(path))
+        self.assertRaises(OSError, rfpkg_client.ensure_runtime_dir, path)
+
+    def test_connect_without_daemon(self):
+        path = os.path.join(self.tmpdir, 'rfpkg')
+        rfpkg_client.ensure_runtime_dir(path)
+        self.assertIsNone(
+            rfpkg_client.connect(os.path.join(path, 'rfpkg.sock')))
+
+    def test_needs_terminal(self):
+        self.assertTrue(rfpkg_client.needs_terminal(['clone', 'foo']))
+        self.assertTrue(rfpkg_client.needs_terminal(
+            ['--release', 'f40', 'push']))
+        self.assertTrue(rfpkg_client.needs_terminal(
+            ['commit', '-p', '-m', 'Update']))
+        self.assertFalse(rfpkg_client.needs_terminal(['commit', '-m', 'x']))
+        self.assertFalse(rfpkg_client.needs_terminal(['sources']))
+
+    @mock.patch('rfpkg_client.connect')
+    @mock.patch('rfpkg_client.fallback', side_effect=SystemExit(0))
+    def test_terminal_commands_fall_back(self, fallback, connect):
+        with mock.patch('sys.argv', ['rfpkgc', 'push']):
+            self.assertRaises(SystemExit, rfpkg_client.main)
+        fallback.assert_called_once_with(['push'])
+        self.assertFalse(connect.called)
+
+    @mock.patch.dict('os.environ', {'RFPKG_SOCKET': '/run/custom.sock'})
+    def test_socket_path_override(self):
+        self.assertEqual(rfpkg_client.socket_path(), '/run/custom.sock')
+
+
+def _stub_run(client):
+    """Command run by the worker, tells whether it leads its group"""
+    os.write(1, ('%s %d %d\n' % (sys.argv[1:], os.getpid(),
+                                   os.getpgrp())).encode('utf-8'))
+    os.write(2, os.getcwd().encode('utf-8'))
+    sys.exit(3)
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'run', 'rfpkg.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _start_server(self):
+        config_args, _ = parse_config_args([])
+        server = Server(config_args, mock.Mock(), idle_timeout=1,
+                        socket_path=self.socket_path)
+        server.warm_client = mock.Mock()
+        server.preload = mock.Mock()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                server.serve_forever()
+                status = 0
+            finally:
+                os._exit(status)
+
+        for i in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.05)
+        return pid
+
+    @mock.patch('rfpkg.__main__.run', new=_stub_run)
+    def test_round_trip(self):
+        server_pid = self._start_server()
+        out_path = os.path.join(self.tmpdir, 'out')
+        err_path = os.path.join(self.tmpdir, 'err')
+
+        sock = rfpkg_client.connect(self.socket_path)
+        self.assertIsNotNone(sock)
+        with open(os.devnull) as stdin, open(out_path, 'w') as out, \
+                open(err_path, 'w') as err:
+            rfpkg_client.send_message(
+                sock, {'argv': ['sources'], 'cwd': self.tmpdir,
+                       'env': {'PATH': os.environ.get('PATH', '')},
+                       'umask': 0o022},
+                fds=[stdin.fileno(), out.fileno(), err.fileno()])
+        reader = rfpkg_client.MessageReader(sock)
+        worker_pid = reader.read()['pid']
+        self.assertEqual(reader.read(), {'status': 3})
+        sock.close()
+
+        with open(out_path) as f:
+            self.assertEqual(f.read(), "['sources'] %d %d\n"
+                             % (worker_pid, worker_pid))
+        with open(err_path) as f:
+            self.assertEqual(f.read(), self.tmpdir)
+
+        # Exits by itself once idle, removing its socket
+        _, status = os.waitpid(server_pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    @mock.patch('rfpkg.daemon.REQUEST_TIMEOUT', new=0.1)
+    def test_silent_client_does_not_block(self):
+        server_pid = self._start_server()
+        try:
+            silent = rfpkg_client.connect(self.socket_path)
+            self.assertIsNotNone(silent)
+            # The server gives up on the silent client and exits once idle
+            _, status = os.waitpid(server_pid, 0)
+            self.assertEqual(os.WEXITSTATUS(status), 0)
+            silent.close()
+        except Exception:
+            os.kill(server_pid, 9)
+            raise
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from six.moves import configparser
+
+from rfpkg.governor import (BACKGROUND, INTERACTIVE, MAX_BACKGROUND_PAUSE,
+                            MAX_SLEEP, TransferGovernor, from_config,
+                            parse_rate)
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TransferGovernorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.time = FakeTime()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _governor(self, **kwargs):
+        governor = TransferGovernor(directory=self.tmpdir,
+                                    clock=self.time.clock,
+                                    sleep=self.time.sleep, **kwargs)
+        self.addCleanup(governor.close)
+        return governor
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('0'), 0)
+        self.assertEqual(parse_rate('512'), 512)
+        self.assertEqual(parse_rate('10M'), 10 * 1024 * 1024)
+        self.assertEqual(parse_rate('1.5 KB/s'), 1536)
+
+    def test_rate_is_shared(self):
+        first = self._governor(rate=1000)
+        second = self._governor(rate=1000)
+
+        # The bucket starts full with one second worth of data
+        first.consume(1000)
+        self.assertEqual(self.time.slept, [])
+        # The other process has to wait for the bucket to refill
+        second.consume(500)
+        self.assertEqual(self.time.slept, [0.5])
+
+    def test_background_yields_to_interactive(self):
+        interactive = self._governor(rate=1000)
+        background = self._governor(rate=1000, priority=BACKGROUND)
+
+        interactive.consume(100)
+        background.consume(100)
+        # Paused until interactive transfers stop for INTERACTIVE_HOLD
+        self.assertTrue(len(self.time.slept) > 1)
+        self.assertTrue(sum(self.time.slept) >= 2)
+
+    def test_background_pause_is_bounded(self):
+        interactive = self._governor(rate=1000)
+        background = self._governor(rate=1000, priority=BACKGROUND)
+
+        interactive.consume(1)
+        start = self.time.now
+        # Interactive transfers keep going while the background one waits
+        original_sleep = self.time.sleep
+
+        def sleep(seconds):
+            original_sleep(seconds)
+            interactive.consume(1)
+        background.sleep = sleep
+
+        background.consume(10)
+        waited = self.time.now - start
+        self.assertTrue(MAX_BACKGROUND_PAUSE <= waited)
+        self.assertTrue(waited <= MAX_BACKGROUND_PAUSE + MAX_SLEEP + 1)
+
+    def test_corrupted_state(self):
+        governor = self._governor(rate=1000)
+        governor.consume(1)
+        for state in [(float('nan'), float('nan'), float('nan')),
+                      (-1e18, 1e18, 1e18), (1e18, -1e18, -1e18)]:
+            with open(os.path.join(self.tmpdir, 'bucket'), 'wb') as f:
+                f.write(struct.pack('=ddd', *state))
+            del self.time.slept[:]
+            governor.consume(100)
+            self.assertTrue(sum(self.time.slept) <= MAX_SLEEP)
+
+    def test_symlink_refused(self):
+        target = os.path.join(self.tmpdir, 'victim')
+        with open(target, 'w') as f:
+            f.write('important')
+        os.symlink(target, os.path.join(self.tmpdir, 'bucket'))
+        os.symlink(target, os.path.join(self.tmpdir, 'slot-0'))
+
+        governor = self._governor(rate=1000, max_transfers=1,
+                                  log=mock.Mock())
+        with governor.slot():
+            governor.consume(100)
+        with open(target) as f:
+            self.assertEqual(f.read(), 'important')
+        self.assertTrue(governor.log.warning.called)
+
+    def test_unsafe_directory(self):
+        os.chmod(self.tmpdir, 0o777)
+        governor = self._governor(rate=1000, max_transfers=1,
+                                  log=mock.Mock())
+        with governor.slot():
+            governor.consume(10000)
+        self.assertEqual(self.time.slept, [])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'bucket')))
+        self.assertTrue(governor.log.warning.called)
+
+        os.chmod(self.tmpdir, 0o1777)
+        governor = self._governor(rate=1000, log=mock.Mock())
+        governor.consume(100)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'bucket')))
+
+    def test_reserved_slots(self):
+        interactive = self._governor(max_transfers=2)
+        background = self._governor(max_transfers=2, priority=BACKGROUND)
+        self.assertEqual(background.slot_count, 1)
+        self.assertEqual(interactive.slot_count, 2)
+
+        with background.slot():
+            # The reserved slot is still free for interactive commands
+            with interactive.slot():
+                self.assertEqual(self.time.slept, [])
+
+    def test_unknown_priority(self):
+        self.assertRaises(ValueError, TransferGovernor, priority='urgent')
+
+    def test_from_config(self):
+        config = configparser.ConfigParser()
+        config.add_section('rfpkg')
+        self.assertIsNone(from_config(config, 'rfpkg'))
+
+        config.set('rfpkg', 'transfer_rate_limit', '2M')
+        config.set('rfpkg', 'transfer_governor_dir', self.tmpdir)
+        governor = from_config(config, 'rfpkg')
+        self.assertEqual(governor.rate, 2 * 1024 * 1024)
+        self.assertEqual(governor.priority, INTERACTIVE)
+
+        with mock.patch.dict(os.environ,
+                             {'RFPKG_TRANSFER_PRIORITY': BACKGROUND}):
+            self.assertEqual(from_config(config, 'rfpkg').priority,
+                             BACKGROUND)
+
+    def test_from_config_invalid(self):
+        config = configparser.ConfigParser()
+        config.add_section('rfpkg')
+        config.set('rfpkg', 'transfer_rate_limit', '2 megs')
+        log = mock.Mock()
+        self.assertIsNone(from_config(config, 'rfpkg', log=log))
+        self.assertTrue(log.warning.called)
+
+        config.set('rfpkg', 'transfer_rate_limit', '2M')
+        with mock.patch.dict(os.environ,
+                             {'RFPKG_TRANSFER_PRIORITY': 'backgroud'}):
+            self.assertIsNone(from_config(config, 'rfpkg', log=log))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pyrpkg.lookaside import CGILookasideCache
+
+from rfpkg.lookaside import RPMFusionLookasideCache
+from rfpkg.metrics import Recorder
+
+
+class FakeGovernor(object):
+    def __init__(self):
+        self.slots = 0
+        self.held = False
+        self.consumed = []
+
+    @contextlib.contextmanager
+    def slot(self):
+        self.slots += 1
+        self.held = True
+        try:
+            yield
+        finally:
+            self.held = False
+
+    def consume(self, nbytes):
+        self.consumed.append(nbytes)
+
+
+class LookasideTestCase(unittest.TestCase):
+    def setUp(self):
+        self.governor = FakeGovernor()
+        self.cache = RPMFusionLookasideCache(
+            'sha512', 'https://pkgs.example.com/repo/pkgs',
+            'https://pkgs.example.com/repo/pkgs/upload.cgi', None, None,
+            'rpms', governor=self.governor)
+        self.recorder = Recorder()
+        self.recorder.enabled = True
+        patcher = mock.patch('rfpkg.lookaside.recorder', new=self.recorder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(CGILookasideCache, 'print_progress')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(CGILookasideCache, 'download')
+    def test_valid_file_does_not_wait_for_a_slot(self, download):
+        self.cache.file_is_valid = mock.Mock(return_value=True)
+        with mock.patch('os.path.exists', return_value=True):
+            self.cache.download('foo', 'foo.tar.gz', 'abc', '/tmp/foo.tar.gz')
+        self.assertEqual(self.governor.slots, 0)
+        self.assertFalse(download.called)
+        self.assertEqual(self.recorder.measurements, [])
+
+    def test_download_is_governed(self):
+        def download(name, filename, hash, outfile, hashtype=None, **kwargs):
+            self.assertTrue(self.governor.held)
+            # What curl reports while downloading
+            for downloaded in (0, 100, 100, 250):
+                self.cache.print_progress(250, downloaded, 0, 0)
+
+        with mock.patch.object(CGILookasideCache, 'download',
+                               side_effect=download):
+            self.cache.download('foo', 'foo.tar.gz', 'abc',
+                                '/nonexistent/foo.tar.gz')
+
+        self.assertEqual(self.governor.slots, 1)
+        self.assertFalse(self.governor.held)
+        self.assertEqual(self.governor.consumed, [100, 150])
+        (_, kind, name, _, nbytes, success), = self.recorder.measurements
+        self.assertEqual((kind, name, nbytes, success),
+                         ('download', 'pkgs.example.com', 250, True))
+
+    def test_failed_upload_is_recorded(self):
+        with mock.patch.object(CGILookasideCache, 'upload',
+                               side_effect=IOError('refused')):
+            self.assertRaises(IOError, self.cache.upload, 'foo',
+                              'foo.tar.gz', 'abc')
+
+        self.assertFalse(self.governor.held)
+        (_, kind, name, _, _, success), = self.recorder.measurements
+        self.assertEqual((kind, name, success),
+                         ('upload', 'pkgs.example.com', False))
+
+    def test_without_governor(self):
+        self.cache.governor = None
+        self.cache.print_progress(0, 0, 100, 50)
+        self.assertEqual(self.cache._transferred, 50)
+
+    def test_hash_file_is_recorded(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'0' * 1000)
+
+        self.cache.hash_file(path)
+        self.cache.hash_file(path, hashtype='md5')
+
+        self.assertEqual([(kind, name, nbytes, success)
+                          for _, kind, name, _, nbytes, success
+                          in self.recorder.measurements],
+                         [('hash', 'sha512', 1000, True),
+                          ('hash', 'md5', 1000, True)])
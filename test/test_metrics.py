@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from six.moves import configparser
+
+from rfpkg.__main__ import _record_command
+from rfpkg.cli import rfpkgClient
+
+from rfpkg.metrics import (DAY, MetricsStore, Recorder, format_prometheus,
+                           percentile)
+
+TEST_CONFIG = os.path.join(os.path.dirname(__file__), 'rfpkg-test.conf')
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'metrics.db')
+        self.store = MetricsStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_percentile(self):
+        values = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.assertEqual(percentile(values, 0.5), 3.0)
+        self.assertEqual(percentile(values, 0.9), 4.6)
+        self.assertEqual(percentile([7.0], 0.99), 7.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_recorder_disabled_by_default(self):
+        recorder = Recorder()
+        recorder.record('command', 'sources', 1.0)
+        self.assertEqual(recorder.measurements, [])
+
+    def test_recorder_flush(self):
+        config = configparser.ConfigParser()
+        config.add_section('rfpkg')
+        config.set('rfpkg', 'metrics', 'True')
+        config.set('rfpkg', 'metrics_db', self.path)
+        recorder = Recorder()
+        recorder.configure(config, 'rfpkg')
+        recorder.command = 'sources'
+
+        with recorder.measure('download', 'pkgs.rpmfusion.org') as m:
+            m['bytes'] = 2048
+        try:
+            with recorder.measure('koji', 'getBuildTarget'):
+                raise IOError('hub unreachable')
+        except IOError:
+            pass
+        recorder.flush()
+
+        self.assertEqual(recorder.measurements, [])
+        summaries = dict((s['kind'], s) for s in self.store.summary())
+        self.assertEqual(summaries['download']['bytes'], 2048)
+        self.assertEqual(summaries['download']['failures'], 0)
+        self.assertEqual(summaries['koji']['failures'], 1)
+
+    @mock.patch('rfpkg.metrics.recorder')
+    def test_serve_not_recorded(self, recorder):
+        def serve():
+            pass
+
+        def sources():
+            pass
+
+        client = mock.Mock()
+        client.args.command = serve
+        _record_command(client, 0.0)
+        self.assertFalse(recorder.record.called)
+
+        client.args.command = sources
+        _record_command(client, 0.0)
+        self.assertEqual(recorder.record.call_args[0][:2],
+                         ('command', 'sources'))
+
+    def test_summary_and_trends(self):
+        now = 100 * DAY
+        measurements = []
+        for i in range(10):
+            # Twice slower this week than the week before
+            measurements.append((now - 1 * DAY, 'download', 'mirror', 2.0,
+                                 4096, True))
+            measurements.append((now - 8 * DAY, 'download', 'mirror', 1.0,
+                                 4096, True))
+        self.store.append(measurements, command='sources')
+
+        summary, = self.store.summary(since=now - 7 * DAY)
+        self.assertEqual(summary['count'], 10)
+        self.assertEqual(summary['quantiles'][0.5], 2.0)
+        self.assertEqual(summary['throughput'], 2048)
+
+        trends = self.store.trends(7 * DAY, now=now)
+        self.assertEqual(trends, {('download', 'mirror'): 1.0})
+
+    def test_prune(self):
+        self.store.append([(10.0, 'hash', 'sha512', 0.5, 10, True),
+                           (20.0, 'hash', 'sha512', 0.5, 10, True)])
+        self.store.prune(15.0)
+        self.assertEqual(self.store.summary()[0]['count'], 1)
+        # Totals keep growing, whatever is pruned
+        totals, = self.store.totals()
+        self.assertEqual(totals['count'], 2)
+        self.assertEqual(totals['bytes'], 20)
+
+    def test_totals_backfilled(self):
+        self.store.close()
+        db = sqlite3.connect(self.path)
+        with db:
+            db.execute('DROP TABLE totals')
+        db.close()
+        self.store = MetricsStore(self.path)
+        self.store.append([(10.0, 'hash', 'sha512', 0.5, 10, False)])
+        self.store.close()
+
+        # Backfilled once from the measurements left
+        db = sqlite3.connect(self.path)
+        with db:
+            db.execute('DROP TABLE totals')
+        db.close()
+        self.store = MetricsStore(self.path)
+        MetricsStore(self.path).close()
+        totals, = self.store.totals()
+        self.assertEqual((totals['count'], totals['failures']), (1, 1))
+
+    def test_readonly_store(self):
+        missing = os.path.join(self.tmpdir, 'missing', 'metrics.db')
+        self.assertRaises(sqlite3.OperationalError, MetricsStore, missing,
+                          readonly=True)
+        self.assertFalse(os.path.exists(os.path.dirname(missing)))
+
+        self.store.append([(10.0, 'hash', 'sha512', 0.5, 10, True)])
+        # Another process is writing
+        writer = sqlite3.connect(self.path)
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            store = MetricsStore(self.path, readonly=True)
+            store.db.execute('PRAGMA busy_timeout = 0')
+            self.assertEqual(store.summary()[0]['count'], 1)
+            self.assertEqual(store.totals()[0]['count'], 1)
+            self.assertRaises(sqlite3.OperationalError, store.append,
+                              [(20.0, 'hash', 'sha512', 0.5, 10, True)])
+            store.close()
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_readonly_store_without_totals(self):
+        self.store.append([(10.0, 'hash', 'sha512', 0.5, 10, False)])
+        self.store.db.execute('DROP TABLE totals')
+        self.store.db.commit()
+
+        store = MetricsStore(self.path, readonly=True)
+        totals, = store.totals(kind='hash')
+        store.close()
+        self.assertEqual((totals['count'], totals['failures']), (1, 1))
+
+    def test_prometheus_format(self):
+        self.store.append([(10.0, 'command', 'new_sources', 1.5, None, False),
+                           (20.0, 'command', 'new_sources', 0.5, None, True)])
+        self.store.prune(15.0)
+        text = format_prometheus(self.store.totals(), self.store.summary(),
+                                 7 * DAY)
+
+        self.assertIn('# TYPE rfpkg_operations_total counter\n', text)
+        self.assertIn('rfpkg_operations_total{kind="command",'
+                      'name="new_sources"} 2\n', text)
+        self.assertIn('rfpkg_operation_failures_total{kind="command",'
+                      'name="new_sources"} 1\n', text)
+        self.assertIn('rfpkg_operation_duration_seconds_total{kind="command",'
+                      'name="new_sources"} 2.0\n', text)
+        self.assertIn('# TYPE rfpkg_operation_duration_seconds_window gauge\n',
+                      text)
+        self.assertIn('rfpkg_operation_duration_seconds_window'
+                      '{kind="command",name="new_sources",quantile="0.5"} '
+                      '0.5\n', text)
+        self.assertIn('rfpkg_metrics_window_seconds 604800.0\n', text)
+        self.assertNotIn(' summary\n', text)
+        self.assertNotIn('rfpkg_transfer_bytes_per_second_window{', text)
+
+
+class StatsCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'rfpkg', 'metrics.db')
+
+    @mock.patch('rfpkg.metrics.recorder', new_callable=Recorder)
+    def test_stats_without_database(self, recorder):
+        recorder.path = self.path
+        config = configparser.ConfigParser()
+        config.read(TEST_CONFIG)
+        log = mock.Mock()
+        with mock.patch('sys.argv', new=['rfpkg', 'stats', '--prometheus',
+                                         os.path.join(self.tmpdir, 'prom')]):
+            client = rfpkgClient(config)
+            client.do_imports(site='rfpkg')
+            client.setupLogging(log)
+            client.parse_cmdline()
+        client.log = log
+
+        client.stats()
+        self.assertTrue(log.info.called)
+        self.assertFalse(os.path.exists(os.path.dirname(self.path)))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import requests
+
+from rfpkg.pkgdb_cache import PkgDBCache, PkgDBCacheError, is_retired
+
+
+def _listing(branch, status='Approved'):
+    return {'collection': {'branchname': branch}, 'status': status,
+            'point_of_contact': 'jdoe',
+            'acls': [{'fas_name': 'jdoe', 'acl': 'commit',
+                      'status': 'Approved'}]}
+
+
+def _response(status_code=200, data=None, etag=None):
+    response = mock.Mock(status_code=status_code, ok=status_code < 400,
+                         url='https://pkgdb.example.com/api/')
+    response.headers = {'ETag': etag} if etag else {}
+    response.json.return_value = data
+    return response
+
+
+class PkgDBCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.session = mock.Mock()
+        self.cache = self._cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _cache(self, ttl=3600):
+        return PkgDBCache(path=os.path.join(self.tmpdir, 'pkgdb.json'),
+                          url='https://pkgdb.example.com/', ttl=ttl,
+                          session=self.session)
+
+    def test_refresh_package(self):
+        package = {'name': 'ffmpeg', 'namespace': 'free', 'status': 'Approved'}
+        self.session.get.return_value = _response(data={'packages': [
+            dict(_listing('master'), package=package),
+            dict(_listing('f39', 'Retired'), package=package)]})
+
+        entry = self.cache.refresh('free', 'ffmpeg')
+
+        self.assertEqual(sorted(entry['branches']), ['f39', 'master'])
+        self.assertTrue(is_retired(entry, 'f39'))
+        self.assertFalse(is_retired(entry, 'master'))
+        self.assertEqual(entry['branches']['master']['acls'],
+                         [{'user': 'jdoe', 'acl': 'commit',
+                           'status': 'Approved'}])
+
+        # Fresh entries are served from the cache, even after a reload
+        self.cache.save()
+        cache = self._cache()
+        self.assertEqual(cache.refresh('free', 'ffmpeg'), entry)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_refresh_expired_package_not_modified(self):
+        package = {'name': 'ffmpeg', 'namespace': 'free'}
+        self.session.get.return_value = _response(
+            data={'packages': [dict(_listing('master'), package=package)]},
+            etag='"v1"')
+        cache = self._cache(ttl=0)
+        entry = cache.refresh('free', 'ffmpeg')
+
+        self.session.get.return_value = _response(status_code=304)
+        self.assertEqual(cache.refresh('free', 'ffmpeg'), entry)
+        self.assertEqual(cache.not_modified, 1)
+        args, kwargs = self.session.get.call_args
+        self.assertEqual(kwargs['headers'], {'If-None-Match': '"v1"'})
+
+    def test_refresh_unknown_package(self):
+        self.session.get.return_value = _response(status_code=404)
+        self.assertIsNone(self.cache.refresh('nonfree', 'ffmpeg'))
+        self.assertIsNone(self.cache.get('nonfree', 'ffmpeg'))
+
+    def test_request_timeout(self):
+        self.session.get.side_effect = requests.ReadTimeout('stalled')
+        self.assertRaises(PkgDBCacheError, self.cache.refresh, 'free',
+                          'ffmpeg')
+        args, kwargs = self.session.get.call_args
+        self.assertEqual(kwargs['timeout'], self.cache.timeout)
+
+    def test_sync_namespace(self):
+        def get(url, params, headers, timeout):
+            packages = [{'name': 'pkg%d-%d' % (params['page'], i),
+                         'status': 'Approved',
+                         'acls': [_listing('master')]} for i in range(2)]
+            return _response(data={'packages': packages, 'page_total': 3})
+        self.session.get.side_effect = get
+
+        self.assertEqual(self.cache.sync('free'), 6)
+        self.assertEqual(self.session.get.call_count, 3)
+        self.assertTrue(self.cache.is_synced('free'))
+        self.assertEqual(len(list(self.cache.entries('free'))), 6)
+        self.assertIsNotNone(self.cache.get('free', 'pkg2-1'))
+
+        # Synced namespaces are skipped until they expire
+        self.assertIsNone(self.cache.sync('free'))
+        self.assertEqual(self.session.get.call_count, 3)
+
+    def test_sync_drops_removed_packages(self):
+        self.session.get.return_value = _response(data={
+            'packages': [{'name': 'a', 'acls': [_listing('master')]},
+                         {'name': 'b', 'acls': [_listing('master')]}]})
+        self.cache.sync('nonfree')
+
+        self.session.get.return_value = _response(data={
+            'packages': [{'name': 'a', 'acls': [_listing('master')]}]})
+        self.assertEqual(self.cache.sync('nonfree', force=True), 1)
+        self.assertEqual([e['name'] for e in self.cache.entries()], ['a'])
+
+    def test_sync_not_modified_pages(self):
+        self.session.get.return_value = _response(data={
+            'packages': [{'name': 'a', 'acls': [_listing('master')]}]},
+            etag='"v1"')
+        cache = self._cache(ttl=0)
+        cache.sync('free')
+        before = cache.data['packages']['free/a']['fetched']
+
+        time.sleep(0.01)
+        self.session.get.return_value = _response(status_code=304)
+        self.assertEqual(cache.sync('free'), 1)
+        self.assertGreater(cache.data['packages']['free/a']['fetched'],
+                           before)
+
+    def test_mark_retired(self):
+        self.assertFalse(self.cache.mark_retired('free', 'ffmpeg', 'master'))
+
+        self.session.get.return_value = _response(data={'packages': [
+            dict(_listing('master'), package={'name': 'ffmpeg'})]})
+        entry = self.cache.refresh('free', 'ffmpeg')
+        self.assertTrue(self.cache.mark_retired('free', 'ffmpeg', 'master'))
+        self.assertTrue(is_retired(entry, 'master'))
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import os
 import shutil
 try:
@@ -12,10 +13,12 @@ except ImportError:
     import mock
 from six.moves import configparser
 import tempfile
+import time
 import subprocess
 import rfpkgdb2client
 
 from rfpkg.cli import rfpkgClient
+from rfpkg.pkgdb_cache import PkgDBCache
 
 TEST_CONFIG = os.path.join(os.path.dirname(__file__), 'rfpkg-test.conf')
 
@@ -23,10 +26,13 @@ TEST_CONFIG = os.path.join(os.path.dirname(__file__), 'rfpkg-test.conf')
 class RetireTestCase(unittest.TestCase):
     def setUp(self):
         self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cachedir, 'pkgdb.json')
         self.log = mock.Mock()
 
     def tearDown(self):
         shutil.rmtree(self.tmpdir)
+        shutil.rmtree(self.cachedir)
 
     def _setup_repo(self, origin):
         subprocess.check_call(
@@ -61,6 +67,8 @@ class RetireTestCase(unittest.TestCase):
     def _fake_client(self, args):
         config = configparser.ConfigParser()
         config.read(TEST_CONFIG)
+        # Never use the pkgdb cache of the developer running the tests
+        config.set('rfpkg', 'pkgdb_cache', self.cache_path)
         with mock.patch('sys.argv', new=args):
             client = rfpkgClient(config)
             client.do_imports(site='rfpkg')
@@ -107,6 +115,83 @@ class RetireTestCase(unittest.TestCase):
         self.assertEqual(PkgDB.return_value.retire_packages.call_args_list,
                          [mock.call('rfpkg', 'master', namespace='rpms')])
 
+    def _entry(self, branches):
+        return {'namespace': 'rpms', 'name': 'rfpkg', 'status': 'Approved',
+                'fetched': time.time(),
+                'branches': dict((branch, {'status': status,
+                                           'point_of_contact': 'jdoe',
+                                           'acls': []})
+                                 for branch, status in branches.items())}
+
+    def _write_cache(self, branches):
+        with open(self.cache_path, 'w') as f:
+            json.dump({'version': 1, 'validators': {}, 'namespaces': {},
+                       'packages': {'rpms/rfpkg': self._entry(branches)}}, f)
+
+    @mock.patch.object(PkgDBCache, 'refresh')
+    @mock.patch('rfpkgdb2client.PkgDB')
+    def test_retire_unknown_branch(self, PkgDB, refresh):
+        self._setup_repo('ssh://git@pkgs.example.com/rpms/rfpkg')
+        self._write_cache({'f40': 'Approved'})
+        # pkgdb confirms that the branch does not exist
+        refresh.return_value = self._entry({'f40': 'Approved'})
+        args = ['rfpkg', '--release=master', 'retire', 'my reason']
+
+        client = self._fake_client(args)
+        self.assertRaises(SystemExit, client.retire)
+
+        refresh.assert_called_once_with('rpms', 'rfpkg', force=True)
+        self.assertFalse(os.path.isfile(os.path.join(self.tmpdir,
+                                                     'dead.package')))
+        self.assertEqual(PkgDB.return_value.retire_packages.call_args_list,
+                         [])
+
+    @mock.patch.object(PkgDBCache, 'refresh')
+    @mock.patch('rfpkgdb2client.PkgDB')
+    def test_retire_branch_created_after_cache(self, PkgDB, refresh):
+        self._setup_repo('ssh://git@pkgs.example.com/rpms/rfpkg')
+        self._write_cache({'f40': 'Approved'})
+        refresh.return_value = self._entry({'f40': 'Approved',
+                                            'master': 'Approved'})
+        args = ['rfpkg', '--release=master', 'retire', 'my reason']
+
+        client = self._fake_client(args)
+        client.retire()
+
+        self.assertRetired('my reason')
+        self.assertEqual(PkgDB.return_value.retire_packages.call_args_list,
+                         [mock.call('rfpkg', 'master', namespace='rpms')])
+
+    @mock.patch.object(PkgDBCache, 'refresh')
+    @mock.patch('rfpkgdb2client.PkgDB')
+    def test_retire_already_retired_in_pkgdb(self, PkgDB, refresh):
+        self._setup_repo('ssh://git@pkgs.example.com/rpms/rfpkg')
+        self._write_cache({'master': 'Retired'})
+        refresh.return_value = self._entry({'master': 'Retired'})
+        args = ['rfpkg', '--release=master', 'retire', 'my reason']
+
+        client = self._fake_client(args)
+        client.retire()
+
+        self.assertRetired('my reason')
+        self.assertEqual(PkgDB.return_value.retire_packages.call_args_list,
+                         [])
+
+    @mock.patch.object(PkgDBCache, 'refresh')
+    @mock.patch('rfpkgdb2client.PkgDB')
+    def test_retire_unretired_after_cache(self, PkgDB, refresh):
+        self._setup_repo('ssh://git@pkgs.example.com/rpms/rfpkg')
+        self._write_cache({'master': 'Retired'})
+        refresh.return_value = self._entry({'master': 'Approved'})
+        args = ['rfpkg', '--release=master', 'retire', 'my reason']
+
+        client = self._fake_client(args)
+        client.retire()
+
+        self.assertRetired('my reason')
+        self.assertEqual(PkgDB.return_value.retire_packages.call_args_list,
+                         [mock.call('rfpkg', 'master', namespace='rpms')])
+
     """
     @mock.patch("requests.get", new=lambda *args, **kwargs: mock.Mock(status_code=404))
     @mock.patch('rpmfusion_cert.read_user_cert')
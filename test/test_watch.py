@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from six.moves import configparser
+
+import koji
+from pyrpkg import rpkgError
+
+import rfpkg.watch
+from rfpkg.cli import rfpkgClient
+from rfpkg.watch import TaskWatcher, UnknownTaskError, watch_tasks
+
+TEST_CONFIG = os.path.join(os.path.dirname(__file__), 'rfpkg-test.conf')
+
+
+class FakeCall(object):
+    def __init__(self, result):
+        self.result = result
+
+
+class FakeHub(object):
+    """Koji hub replaying a scripted state history per task
+
+    Every getTaskInfo call of a task moves it one step further in its
+    history, the last state is kept forever.
+    """
+
+    def __init__(self, histories, children=None):
+        self.histories = dict((task_id, list(states))
+                              for task_id, states in histories.items())
+        self.children = children or {}
+        self.multicalls = []
+
+    def getTaskInfo(self, task_id, request=False):
+        if task_id not in self.histories:
+            return None
+        states = self.histories[task_id]
+        state = states.pop(0) if len(states) > 1 else states[0]
+        info = {'id': task_id, 'method': 'buildArch', 'arch': 'x86_64',
+                'state': koji.TASK_STATES[state]}
+        if request:
+            info['request'] = ['foo-1.0-1.src.rpm', 1, 'x86_64']
+        return info
+
+    def getTaskChildren(self, task_id):
+        return [{'id': child} for child in self.children.get(task_id, [])]
+
+    @contextlib.contextmanager
+    def multicall(self, strict=False):
+        calls = []
+        hub = self
+
+        class Recorder(object):
+            def getTaskInfo(self, *args, **kwargs):
+                calls.append(('getTaskInfo', args[0],
+                              kwargs.get('request', False)))
+                return FakeCall(hub.getTaskInfo(*args, **kwargs))
+
+            def getTaskChildren(self, *args):
+                return FakeCall(hub.getTaskChildren(*args))
+
+        yield Recorder()
+        self.multicalls.append(calls)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class TaskWatcherTestCase(unittest.TestCase):
+    def _watch(self, hub, task_ids, **kwargs):
+        events = []
+        kwargs.setdefault('poll_interval', 0)
+        kwargs.setdefault('max_interval', 0)
+        rv = watch_tasks(hub, task_ids, on_event=events.append, **kwargs)
+        return rv, events
+
+    def test_single_multicall_per_poll(self):
+        hub = FakeHub(dict((task_id, ['OPEN', 'CLOSED'])
+                           for task_id in range(1, 21)))
+        rv, events = self._watch(hub, list(range(1, 21)))
+
+        self.assertEqual(rv, 0)
+        self.assertEqual(len(hub.multicalls), 2)
+        self.assertEqual(len(hub.multicalls[0]), 20)
+        self.assertEqual(len(events), 40)
+
+    def test_transitions(self):
+        hub = FakeHub({1: ['FREE', 'OPEN', 'OPEN', 'CLOSED']})
+        rv, events = self._watch(hub, [1])
+
+        self.assertEqual(rv, 0)
+        self.assertEqual([(e['previous_state'], e['state']) for e in events],
+                         [(None, 'FREE'), ('FREE', 'OPEN'),
+                          ('OPEN', 'CLOSED')])
+
+    def test_children_are_watched(self):
+        hub = FakeHub({1: ['OPEN', 'OPEN', 'CLOSED'],
+                       2: ['OPEN', 'CLOSED'], 3: ['OPEN', 'CLOSED']},
+                      children={1: [2, 3]})
+        rv, events = self._watch(hub, [1])
+
+        self.assertEqual(rv, 0)
+        self.assertEqual(sorted(set((e['task_id'], e['parent'])
+                                    for e in events)),
+                         [(1, None), (2, 1), (3, 1)])
+
+    def test_request_fetched_once(self):
+        hub = FakeHub({1: ['FREE', 'OPEN', 'OPEN', 'CLOSED']})
+        rv, events = self._watch(hub, [1])
+
+        self.assertEqual(rv, 0)
+        self.assertEqual([call[2] for calls in hub.multicalls
+                          for call in calls],
+                         [True, False, False, False])
+        # The label computed from the request is kept for later events
+        self.assertEqual(len(set(e['label'] for e in events)), 1)
+
+    def test_results_summary(self):
+        hub = FakeHub({1: ['OPEN', 'CLOSED'], 2: ['OPEN', 'FAILED']})
+        log = logging.getLogger('test_watch')
+        with self.assertLogs(log, level='INFO') as cm:
+            self._watch(hub, [1, 2], results_log=log)
+        messages = [record.getMessage() for record in cm.records]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith('1 '))
+        self.assertTrue(messages[0].endswith(' completed successfully'))
+        self.assertTrue(messages[1].startswith('2 '))
+        self.assertTrue(messages[1].endswith(' failed'))
+
+    def test_unknown_task(self):
+        hub = FakeHub({1: ['OPEN', 'CLOSED']})
+        self.assertRaises(UnknownTaskError, self._watch, hub, [1, 999])
+
+    def test_failed_task(self):
+        hub = FakeHub({1: ['OPEN', 'CLOSED'], 2: ['OPEN', 'FAILED']})
+        rv, events = self._watch(hub, [1, 2])
+        self.assertEqual(rv, 1)
+
+    def test_adaptive_backoff(self):
+        hub = FakeHub({1: ['OPEN']})
+        watcher = TaskWatcher(hub, [1], poll_interval=2, max_interval=5,
+                              backoff=2, clock=FakeClock())
+        now = watcher.clock()
+        watcher._add(1, None, now)
+        task = watcher.tasks[1]
+
+        intervals = []
+        for i in range(5):
+            watcher._update(task, hub.getTaskInfo(1), [], now)
+            intervals.append(task.interval)
+        # Reset to the initial interval on the first transition only
+        self.assertEqual(intervals, [2, 4, 5, 5, 5])
+
+        watcher._update(task, {'state': koji.TASK_STATES['CLOSED']}, [], now)
+        self.assertEqual(task.interval, 2)
+        self.assertTrue(watcher.done)
+
+
+class BuildWatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        subprocess.check_call(['git', 'init'], cwd=self.tmpdir,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.log = mock.Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _fake_client(self, args):
+        config = configparser.ConfigParser()
+        config.read(TEST_CONFIG)
+        config.set('rfpkg', 'watch_poll_interval', '0')
+        config.set('rfpkg', 'watch_max_interval', '0')
+        with mock.patch('sys.argv', new=['rfpkg', '--path', self.tmpdir]
+                        + args):
+            client = rfpkgClient(config)
+            client.do_imports(site='rfpkg')
+            client.setupLogging(self.log)
+            client.parse_cmdline()
+        client.check_remote_rules_gating = mock.Mock()
+        client._build = mock.Mock(return_value=1)
+        self.hub = FakeHub({1: ['OPEN', 'CLOSED']})
+        self.hub.logout = mock.Mock()
+        client.cmd._kojisession = self.hub
+        return client
+
+    @mock.patch('koji_cli.lib.watch_tasks')
+    def test_build_uses_rfpkg_watcher(self, koji_watch_tasks):
+        client = self._fake_client(['build'])
+        with mock.patch('rfpkg.watch.watch_tasks',
+                        wraps=rfpkg.watch.watch_tasks) as watch:
+            self.assertEqual(client.build(), 0)
+
+        self.assertEqual(watch.call_args[0][:2], (self.hub, [1]))
+        self.assertFalse(koji_watch_tasks.called)
+        self.assertEqual(len(self.hub.multicalls), 2)
+
+    @mock.patch('rfpkg.watch.watch_tasks')
+    def test_build_nowait(self, watch):
+        client = self._fake_client(['build', '--nowait'])
+        client.build()
+        self.assertFalse(watch.called)
+
+    def test_watch_unknown_task(self):
+        client = self._fake_client(['watch-tasks', '1', '999'])
+        client.cmd._anon_kojisession = self.hub
+        self.assertRaises(rpkgError, client.watch_tasks)